@@ -1,17 +1,324 @@
+import os
+import hashlib
 import numpy as np
 import datetime as dt
 from dateutil.relativedelta import relativedelta
-from collections import defaultdict
-from scipy.optimize import fsolve
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import warnings
 warnings.filterwarnings('ignore')
 
+# 计算器版本，计算规则或求解方法变化时更新，使持久化的计算结果失效
+CALCULATOR_VERSION = "1.5"
+
+class IRRResult:
+    """单位周期费率求解结果"""
+    def __init__(self, rate, converged, iterations, function_calls, message):
+        self.rate = rate                      # 单位周期费率R
+        self.converged = converged            # 是否收敛
+        self.iterations = iterations          # 牛顿/二分迭代次数
+        self.function_calls = function_calls  # 现金流方程求值次数
+        self.message = message                # 求解状态说明
+    
+    def __repr__(self):
+        return (f"IRRResult(rate={self.rate!r}, converged={self.converged}, "
+                f"iterations={self.iterations}, function_calls={self.function_calls}, "
+                f"message={self.message!r})")
+
+
+class FeeRateCache:
+    """费用年化率的LRU缓存（键为规范化后的计算参数）"""
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize  # 最多缓存的结果数，0表示不缓存
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+    
+    def get(self, key):
+        """返回缓存的年化率，未命中时返回None"""
+        rate = self._data.get(key)
+        if rate is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return rate
+    
+    def put(self, key, rate):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = rate
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        self._data.clear()
+        self.hits = self.misses = self.evictions = 0
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __repr__(self):
+        return (f"FeeRateCache(hits={self.hits}, misses={self.misses}, "
+                f"evictions={self.evictions}, size={len(self._data)}, maxsize={self.maxsize})")
+
+
+def _cashflow_residuals(R, targets, amounts, st, ft):
+    """
+    现金流方程 f(R) = target - Σ P / [(1+R)^st × (1+R×ft)] 及其导数（矩阵形式）
+    
+    amounts、st、ft 每行对应一个方程，R、targets 为各行的费率和左边目标值。
+    f(R) 在 R > -1 上单调递增，导数 f'(R) = Σ PV × [st/(1+R) + ft/(1+R×ft)]
+    """
+    R = R[:, np.newaxis]
+    simple = 1 + R * ft
+    present_values = amounts / ((1 + R) ** st * simple)
+    values = targets - present_values.sum(axis=1)
+    derivatives = np.sum(present_values * (st / (1 + R) + ft / simple), axis=1)
+    return values, derivatives
+
+
+def solve_unit_period_rates(targets, amounts, st, ft, initial_guesses,
+                            xtol=1e-10, maxiter=100):
+    """
+    同时求解多个现金流方程 target = Σ P / [(1+R)^st × (1+R×ft)] 的单位周期费率R
+    
+    amounts、st、ft 为二维数组，每行一个方程（长度不足的行以金额0补齐）。
+    各行先以R=0为起点确定包含根的区间，再使用解析导数的牛顿法迭代，
+    牛顿步越出区间或收敛过慢时改用二分，保证在区间内收敛。
+    每次迭代只对尚未收敛的行整体求值。
+    
+    返回:
+        IRRResult，各字段为与行对应的数组
+    """
+    targets = np.asarray(targets, dtype=float)
+    initial_guesses = np.asarray(initial_guesses, dtype=float)
+    amounts = np.asarray(amounts, dtype=float)
+    st = np.asarray(st, dtype=float)
+    ft = np.asarray(ft, dtype=float)
+    
+    n = len(targets)
+    rates = np.full(n, np.nan)
+    converged = np.zeros(n, dtype=bool)
+    iterations = np.zeros(n, dtype=int)
+    function_calls = np.zeros(n, dtype=int)
+    messages = np.full(n, "无法确定求根区间", dtype=object)
+    
+    def evaluate(rows, R):
+        function_calls[rows] += 1
+        return _cashflow_residuals(R, targets[rows], amounts[rows], st[rows], ft[rows])
+    
+    def finish(rows, R, message):
+        rates[rows] = R
+        converged[rows] = True
+        messages[rows] = message
+    
+    # 第一步：确定求根区间 [lo, hi]，满足 f(lo) < 0 < f(hi)
+    all_rows = np.arange(n)
+    f_zero, _ = evaluate(all_rows, np.zeros(n))
+    finish(all_rows[f_zero == 0], 0.0, "费率为零")
+    
+    lo = np.zeros(n)
+    hi = np.zeros(n)
+    bracketed = np.zeros(n, dtype=bool)
+    
+    # 根为正值，向上倍增搜索
+    rows = all_rows[f_zero < 0]
+    hi[rows] = np.maximum(initial_guesses[rows], 1e-4)
+    while rows.size:
+        f_hi, _ = evaluate(rows, hi[rows])
+        finish(rows[f_hi == 0], hi[rows[f_hi == 0]], "区间端点即为根")
+        bracketed[rows[f_hi > 0]] = True
+        rows = rows[f_hi < 0]
+        lo[rows] = hi[rows]
+        hi[rows] *= 2
+        rows = rows[hi[rows] <= 1e6]
+    
+    # 根为负值，在 (-1, 0) 内向下搜索
+    rows = all_rows[f_zero > 0]
+    lo[rows] = -0.5
+    while rows.size:
+        f_lo, _ = evaluate(rows, lo[rows])
+        finish(rows[f_lo == 0], lo[rows[f_lo == 0]], "区间端点即为根")
+        bracketed[rows[f_lo < 0]] = True
+        rows = rows[f_lo > 0]
+        hi[rows] = lo[rows]
+        lo[rows] = (lo[rows] - 1) / 2
+        rows = rows[1 + lo[rows] >= 1e-12]
+    
+    # 第二步：带区间保护的牛顿迭代
+    active = all_rows[bracketed]
+    inside = (lo < initial_guesses) & (initial_guesses < hi)
+    R = np.where(inside, initial_guesses, (lo + hi) / 2)
+    step = hi - lo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for iteration in range(1, maxiter + 1):
+            if not active.size:
+                break
+            current = R[active]
+            values, derivatives = evaluate(active, current)
+            iterations[active] = iteration
+            
+            exact = values == 0
+            finish(active[exact], current[exact], "收敛")
+            
+            # 更新区间
+            lo[active] = np.where(values < 0, current, lo[active])
+            hi[active] = np.where(values > 0, current, hi[active])
+            
+            # 牛顿步；越界或下降过慢时改用二分
+            previous_step = step[active]
+            newton_step = np.where(derivatives > 0, values / derivatives, np.nan)
+            new_R = current - newton_step
+            midpoint = (lo[active] + hi[active]) / 2
+            bisect = ~((lo[active] < new_R) & (new_R < hi[active]))
+            bisect |= np.abs(newton_step) > np.abs(previous_step) / 2
+            new_R = np.where(bisect, midpoint, new_R)
+            step[active] = np.where(bisect, current - midpoint, newton_step)
+            
+            done = ~exact & (np.abs(new_R - current) <= xtol * np.abs(current) + 1e-15)
+            finish(active[done], new_R[done], "收敛")
+            
+            R[active] = new_R
+            active = active[~(exact | done)]
+    
+    # 达到最大迭代次数仍未收敛
+    rates[active] = R[active]
+    messages[active] = f"迭代{maxiter}次未收敛"
+    
+    return IRRResult(rates, converged, iterations, function_calls, messages)
+
+
+def solve_unit_period_rate(target, amounts, st, ft, initial_guess=0.0,
+                           xtol=1e-10, maxiter=100):
+    """
+    求解单个现金流方程 target = Σ P / [(1+R)^st × (1+R×ft)] 的单位周期费率R
+    
+    返回:
+        IRRResult
+    """
+    result = solve_unit_period_rates(
+        [target], np.atleast_2d(amounts), np.atleast_2d(st), np.atleast_2d(ft),
+        [initial_guess], xtol, maxiter
+    )
+    return IRRResult(float(result.rate[0]), bool(result.converged[0]),
+                     int(result.iterations[0]), int(result.function_calls[0]),
+                     result.message[0])
+
+
+def add_months(base_date, month_offsets):
+    """
+    按月对日推算日期，与 base_date + relativedelta(months=k) 一致
+    （目标月份没有对应日时取该月最后一天），返回datetime64[D]数组
+    """
+    base_month = np.datetime64(base_date, 'M')
+    months = base_month + np.asarray(month_offsets)
+    month_starts = months.astype('datetime64[D]')
+    month_days = ((months + 1).astype('datetime64[D]') - month_starts).astype(int)
+    return month_starts + (np.minimum(base_date.day, month_days) - 1)
+
+
+class CashFlowSchedule:
+    """
+    现金流计划（数组存储）
+    
+    第i笔现金流发生在base_date之后month_offsets[i]个月（按月对日），
+    金额为amounts[i]，距贷款起始日periods[i]个单位周期；日期在需要时才生成
+    """
+    __slots__ = ("base_date", "month_offsets", "amounts", "periods", "_dates")
+    
+    def __init__(self, base_date, month_offsets, amounts, periods=None):
+        self.base_date = base_date
+        self.month_offsets = month_offsets
+        self.amounts = amounts
+        self.periods = periods
+        self._dates = None
+    
+    def __len__(self):
+        return len(self.amounts)
+    
+    @property
+    def dates(self):
+        """各笔现金流的日期（datetime64[D]数组）"""
+        if self._dates is None:
+            self._dates = add_months(self.base_date, self.month_offsets)
+        return self._dates
+    
+    def split_periods(self):
+        """拆分期数为整数期st（与int()一致向零取整）和小数期ft"""
+        st = np.trunc(self.periods)
+        return st, self.periods - st
+
+
+class PaymentSchedule:
+    """
+    单笔贷款的还款计划
+    
+    由FinanceCostCalculator.build_payment_schedule构建，同一笔贷款的各项费用
+    及本息现金流共用，避免重复进行日期推算
+    """
+    __slots__ = (
+        "calculator", "loan_amount", "loan_term", "repayment_method", "start_date",
+        "first_payment_date", "interest_frequency", "unit_period", "cash_flows",
+        "amounts", "st", "ft", "_fee_periods", "_payment_dates"
+    )
+    
+    def __init__(self, calculator, loan_amount, loan_term, repayment_method,
+                 start_date, first_payment_date, interest_frequency):
+        self.calculator = calculator
+        self.loan_amount = loan_amount
+        self.loan_term = loan_term
+        self.repayment_method = repayment_method
+        self.start_date = start_date
+        self.first_payment_date = first_payment_date
+        self.interest_frequency = interest_frequency
+        self.unit_period = calculator.frequency_periods[interest_frequency]
+        
+        # 还款计划及其数组形式：本金、整数期、小数期
+        self.cash_flows = calculator._get_payment_schedule(
+            loan_amount, loan_term, repayment_method,
+            start_date, first_payment_date, self.unit_period
+        )
+        self.amounts = self.cash_flows.amounts
+        self.st, self.ft = self.cash_flows.split_periods()
+        
+        # 按费用频率缓存的费用期数，按付息周期缓存的还款日期
+        self._fee_periods = {}
+        self._payment_dates = {}
+    
+    def fee_arrays(self, fee_amount, fee_frequency):
+        """周期性费用的现金流数组：金额、整数期、小数期"""
+        if fee_frequency not in self._fee_periods:
+            fee_schedule = self.calculator._get_fee_payment_schedule(
+                1.0, fee_frequency, self.loan_term, self.start_date, self.first_payment_date
+            )
+            self._fee_periods[fee_frequency] = fee_schedule.split_periods()
+        
+        st, ft = self._fee_periods[fee_frequency]
+        return np.full(len(st), float(fee_amount)), st, ft
+    
+    def payment_dates(self, period_months):
+        """按付息周期生成的还款日期列表"""
+        if period_months not in self._payment_dates:
+            self._payment_dates[period_months] = self.calculator.generate_payment_dates(
+                self.first_payment_date, self.loan_term, period_months
+            )
+        return self._payment_dates[period_months]
+
+
 class FinanceCostCalculator:
     """
     企业融资成本计算器
     基于《企业贷款综合融资成本年化率的计算规则及示例》实现
     """
-    def __init__(self, calculation_mode="auto"):
+    # 多项式求根的最高次数：求根需对同阶伴随矩阵求特征值，次数更高时（如按日计息）改用牛顿迭代
+    POLYNOMIAL_MAX_DEGREE = 60
+    
+    def __init__(self, calculation_mode="auto", solver="newton", cache_size=4096):
         """
         初始化计算器
         
@@ -20,8 +327,24 @@ class FinanceCostCalculator:
                 - "precise": 精确计算期数（考虑日期偏移）
                 - "integer": 使用整数期数
                 - "auto": 自动选择（默认，根据首次还款日智能选择）
+            solver: 费率求解方法
+                - "newton": 区间保护的牛顿迭代（默认）
+                - "polynomial": 期数均为整数的方程按多项式直接求根，其余仍用牛顿迭代；
+                  求根不迭代、结果与初值无关，但计算量随期数的三次方增长，
+                  批量计算比牛顿迭代慢数倍，适合用于核对结果
+            cache_size: 费用年化率缓存的最大条数，0表示不缓存
         """
         self.calculation_mode = calculation_mode
+        self.solver = solver
+        
+        # 最近一次费率求解的结果（迭代次数、收敛状态），便于核查
+        self.last_irr_result = None
+        
+        # 最近一次批量计算中失败的贷款（贷款下标 -> 错误信息）
+        self.last_batch_errors = {}
+        
+        # 费用年化率缓存，相同参数的费用不重复求解
+        self.fee_rate_cache = FeeRateCache(cache_size)
         
         # 频率周期的月份数
         self.frequency_periods = {
@@ -63,38 +386,41 @@ class FinanceCostCalculator:
             start_date: 贷款起始日
             end_date: 贷款到期日
             first_payment_date: 首次还款日
-            fees: 费用列表 [{"name": 名称, "amount": 金额, "frequency": 频率, "is_bank_bearing": 是否银行承担}, ...]
+            fees: 费用列表 [Fee, ...]
             
         返回:
             (综合融资成本, 费用明细列表)
         """
-        # 计算各项费用的年化率
+        # 同时计算各项非银行承担费用的年化率
+        customer_fees = [fee for fee in fees if fee.is_bank_bearing != 1]
+        customer_rates = iter(self.calculate_fee_annual_rates_irr(
+            [fee.amount for fee in customer_fees],
+            [fee.frequency for fee in customer_fees],
+            loan_amount,
+            loan_term,
+            repayment_method,
+            start_date,
+            first_payment_date,
+            interest_frequency
+        ) if customer_fees else [])
+        
         total_fee_annual_rate = 0
         fee_details = []
         
         for fee in fees:
             # 如果费用由银行承担，不计入融资成本
-            if fee.get("is_bank_bearing", 0) == 1:
+            if fee.is_bank_bearing == 1:
                 fee_details.append({
-                    "name": fee["name"],
-                    "amount": fee["amount"],
+                    "name": fee.name,
+                    "amount": fee.amount,
                     "annual_rate": 0,
                     "period_rate": 0,
                     "is_bank_bearing": True
                 })
                 continue
             
-            # 使用IRR方法计算费用年化率
-            fee_annual_rate = self.calculate_fee_annual_rate_irr(
-                fee["amount"], 
-                fee["frequency"], 
-                loan_amount, 
-                loan_term, 
-                repayment_method,
-                start_date,
-                first_payment_date,
-                interest_frequency
-            )
+            # 使用IRR方法计算的费用年化率
+            fee_annual_rate = float(next(customer_rates))
             
             # 累加到总费用年化率
             total_fee_annual_rate += fee_annual_rate
@@ -103,8 +429,8 @@ class FinanceCostCalculator:
             period_rate = fee_annual_rate * loan_term / 12
             
             fee_details.append({
-                "name": fee["name"],
-                "amount": fee["amount"],
+                "name": fee.name,
+                "amount": fee.amount,
                 "annual_rate": fee_annual_rate,
                 "period_rate": period_rate,
                 "is_bank_bearing": False
@@ -115,188 +441,392 @@ class FinanceCostCalculator:
         
         return total_cost * 100, fee_details  # 返回百分比格式
     
+    def calculate_finance_cost_batch(self, loan_amounts, repayment_methods, loan_terms,
+                                     interest_frequencies, interest_rates, start_dates,
+                                     end_dates, first_payment_dates, fee_loan_index=(),
+                                     fee_amounts=(), fee_frequencies=(), fee_is_bank_bearing=(),
+                                     chunk_size=1024):
+        """
+        批量计算一组贷款的综合融资成本（列式输入）
+        
+        参数:
+            loan_amounts ~ first_payment_dates: 与calculate_finance_cost含义相同，
+                每个参数为长度等于贷款笔数的数组/列表
+            fee_loan_index: 费用表每行所属贷款的下标
+            fee_amounts: 费用金额(元)
+            fee_frequencies: 费用支付频率
+            fee_is_bank_bearing: 是否银行承担（1/0），缺省为全部不承担
+            chunk_size: 每次同时求解的费用方程个数上限，控制内存占用
+            
+        返回:
+            (综合融资成本数组(百分比), 费用年化率数组(小数，与费用表逐行对应))
+            计算失败的贷款其综合融资成本及费用年化率为nan，失败原因记录在
+            last_batch_errors中（贷款下标 -> 错误信息）
+        """
+        loan_amounts = np.asarray(loan_amounts, dtype=float)
+        interest_rates = np.asarray(interest_rates, dtype=float)
+        fee_loan_index = np.asarray(fee_loan_index, dtype=int)
+        fee_amounts = np.asarray(fee_amounts, dtype=float)
+        if len(fee_is_bank_bearing) == 0:
+            fee_is_bank_bearing = np.zeros(len(fee_loan_index), dtype=int)
+        fee_is_bank_bearing = np.asarray(fee_is_bank_bearing, dtype=int)
+        
+        num_loans = len(loan_amounts)
+        fee_annual_rates = np.zeros(len(fee_loan_index))
+        self.last_batch_errors = {}
+        
+        # 按贷款分组需要计算的费用（银行承担的费用年化率为0）
+        customer_fees = np.flatnonzero(fee_is_bank_bearing != 1)
+        order = customer_fees[np.argsort(fee_loan_index[customer_fees], kind="stable")]
+        loan_ids, starts = np.unique(fee_loan_index[order], return_index=True)
+        
+        # 第一步：逐笔构建还款计划及各费用的现金流方程
+        equations = []
+        equation_rows = []   # 方程对应的费用表行
+        equation_loans = []  # 方程对应的贷款下标
+        equation_keys = []   # 方程对应的缓存键
+        annual_factors = []
+        for loan_id, fee_rows in zip(loan_ids, np.split(order, starts[1:])):
+            try:
+                # 命中缓存的费用直接取结果
+                keys = [
+                    self._fee_rate_key(
+                        fee_amounts[row], fee_frequencies[row], loan_amounts[loan_id],
+                        loan_terms[loan_id], repayment_methods[loan_id], start_dates[loan_id],
+                        first_payment_dates[loan_id], interest_frequencies[loan_id]
+                    )
+                    for row in fee_rows
+                ]
+                cached = [self.fee_rate_cache.get(key) for key in keys]
+                for row, rate in zip(fee_rows, cached):
+                    if rate is not None:
+                        fee_annual_rates[row] = rate
+                keys = [key for key, rate in zip(keys, cached) if rate is None]
+                fee_rows = [row for row, rate in zip(fee_rows, cached) if rate is None]
+                if not fee_rows:
+                    continue
+                
+                # 同一笔贷款的费用共用还款计划
+                schedule = self.build_payment_schedule(
+                    loan_amounts[loan_id],
+                    int(loan_terms[loan_id]),
+                    repayment_methods[loan_id],
+                    start_dates[loan_id],
+                    first_payment_dates[loan_id],
+                    interest_frequencies[loan_id]
+                )
+                loan_equations = [
+                    self._fee_cashflow_equation(fee_amounts[row], fee_frequencies[row], schedule)
+                    for row in fee_rows
+                ]
+            except (ValueError, KeyError, ZeroDivisionError) as e:
+                fee_annual_rates[fee_rows] = np.nan
+                self.last_batch_errors[int(loan_id)] = str(e)
+                continue
+            
+            equations.extend(loan_equations)
+            equation_keys.extend(keys)
+            equation_rows.extend(fee_rows)
+            equation_loans.extend([loan_id] * len(fee_rows))
+            annual_factors.extend([self._periods_per_year(schedule.unit_period)] * len(fee_rows))
+        
+        # 第二步：按现金流长度排序后分块，整块同时求解
+        equation_rows = np.asarray(equation_rows, dtype=int)
+        equation_loans = np.asarray(equation_loans, dtype=int)
+        annual_factors = np.asarray(annual_factors, dtype=float)
+        by_length = np.argsort([len(eq[1]) for eq in equations], kind="stable")
+        for chunk in np.split(by_length, np.arange(chunk_size, len(by_length), chunk_size)):
+            result = self._solve_fee_equations([equations[i] for i in chunk])
+            self.last_irr_result = result
+            
+            rows = equation_rows[chunk]
+            fee_annual_rates[rows] = np.maximum(0, result.rate * annual_factors[chunk])
+            for i in np.flatnonzero(result.converged):
+                self.fee_rate_cache.put(equation_keys[chunk[i]], float(fee_annual_rates[rows[i]]))
+            
+            for i in np.flatnonzero(~result.converged):
+                loan_id = int(equation_loans[chunk[i]])
+                self.last_batch_errors[loan_id] = f"费用年化率求解失败: {result.message[i]}"
+        
+        # 求解失败的贷款，其全部费用年化率记为nan
+        for loan_id in self.last_batch_errors:
+            fee_annual_rates[fee_loan_index == loan_id] = np.nan
+        
+        # 综合融资成本 = 贷款年化率 + 总费用年化率
+        total_fee_annual_rates = np.bincount(fee_loan_index, weights=fee_annual_rates,
+                                             minlength=num_loans)
+        total_costs = interest_rates + total_fee_annual_rates
+        
+        return total_costs * 100, fee_annual_rates  # 综合融资成本返回百分比格式
+    
+    def input_fingerprint(self, loan_amount, repayment_method, loan_term, interest_frequency,
+                          interest_rate, start_date, end_date, first_payment_date, fees):
+        """
+        计算输入的指纹（SHA-1），用于持久化缓存计算结果
+        
+        参数与calculate_finance_cost相同，计算模式及求解方法也计入指纹
+        """
+        inputs = (
+            float(loan_amount), repayment_method, int(loan_term), interest_frequency,
+            float(interest_rate), start_date.toordinal(), end_date.toordinal(),
+            first_payment_date.toordinal(),
+            tuple((float(fee.amount), fee.frequency, int(fee.is_bank_bearing or 0)) for fee in fees),
+            self.calculation_mode, self.solver
+        )
+        return hashlib.sha1(repr(inputs).encode("utf-8")).hexdigest()
+    
+    def build_payment_schedule(self, loan_amount, loan_term, repayment_method,
+                               start_date, first_payment_date, interest_frequency):
+        """构建单笔贷款的还款计划，供该笔贷款的各项费用及本息现金流共用"""
+        return PaymentSchedule(
+            self, loan_amount, loan_term, repayment_method,
+            start_date, first_payment_date, interest_frequency
+        )
+    
     def calculate_fee_annual_rate_irr(self, fee_amount, fee_frequency, loan_amount, 
                                       loan_term, repayment_method, start_date, 
-                                      first_payment_date, interest_frequency):
+                                      first_payment_date, interest_frequency, schedule=None):
         """
         使用内部收益率法计算费用的年化利率
         基于info.pdf中的计算规则
+        
+        schedule: 由build_payment_schedule构建的还款计划，为None时按需构建
         """
-        # 确定单位周期（月）
-        unit_period = self.frequency_periods[interest_frequency]
+        annual_rates = self.calculate_fee_annual_rates_irr(
+            [fee_amount], [fee_frequency], loan_amount, loan_term, repayment_method,
+            start_date, first_payment_date, interest_frequency, schedule
+        )
+        return float(annual_rates[0])
+    
+    def calculate_fee_annual_rates_irr(self, fee_amounts, fee_frequencies, loan_amount,
+                                       loan_term, repayment_method, start_date,
+                                       first_payment_date, interest_frequency, schedule=None):
+        """
+        使用内部收益率法同时计算同一笔贷款多项费用的年化利率
         
-        # 构建现金流方程
-        if fee_frequency == "期初一次性付费":
-            # 期初一次性付费的计算
-            return self._calculate_one_time_fee_rate(
-                fee_amount, loan_amount, loan_term, repayment_method,
-                start_date, first_payment_date, unit_period
-            )
-        else:
-            # 周期性付费的计算
-            return self._calculate_periodic_fee_rate(
-                fee_amount, fee_frequency, loan_amount, loan_term, 
-                repayment_method, start_date, first_payment_date, unit_period
+        各项费用的现金流方程组成矩阵后一次性求解，返回与费用顺序对应的年化率数组
+        """
+        annual_rates = np.zeros(len(fee_amounts))
+        
+        # 先查缓存，只求解未命中的费用
+        keys = [
+            self._fee_rate_key(fee_amount, fee_frequency, loan_amount, loan_term, repayment_method,
+                               start_date, first_payment_date, interest_frequency)
+            for fee_amount, fee_frequency in zip(fee_amounts, fee_frequencies)
+        ]
+        missing = []
+        for i, key in enumerate(keys):
+            rate = self.fee_rate_cache.get(key)
+            if rate is None:
+                missing.append(i)
+            else:
+                annual_rates[i] = rate
+        if not missing:
+            return annual_rates
+        
+        if schedule is None:
+            schedule = self.build_payment_schedule(
+                loan_amount, loan_term, repayment_method,
+                start_date, first_payment_date, interest_frequency
             )
+        
+        equations = [
+            self._fee_cashflow_equation(fee_amounts[i], fee_frequencies[i], schedule)
+            for i in missing
+        ]
+        result = self._solve_fee_equations(equations)
+        self.last_irr_result = result
+        if not result.converged.all():
+            message = result.message[np.flatnonzero(~result.converged)[0]]
+            raise ValueError(f"费用年化率求解失败: {message}")
+        
+        # 确保非负
+        rates = np.maximum(0, result.rate * self._periods_per_year(schedule.unit_period))
+        for i, rate in zip(missing, rates):
+            annual_rates[i] = rate
+            self.fee_rate_cache.put(keys[i], float(rate))
+        return annual_rates
     
-    def _calculate_one_time_fee_rate(self, fee_amount, loan_amount, loan_term, 
-                                     repayment_method, start_date, first_payment_date, 
-                                     unit_period):
-        """计算期初一次性付费的年化率"""
-        # 计算还款现金流
-        payment_schedule = self._get_payment_schedule(
-            loan_amount, loan_term, repayment_method, 
-            start_date, first_payment_date, unit_period
-        )
+    def _fee_rate_key(self, fee_amount, fee_frequency, loan_amount, loan_term, repayment_method,
+                      start_date, first_payment_date, interest_frequency):
+        """费用年化率缓存的键：规范化后的全部计算参数"""
+        return (float(fee_amount), fee_frequency, float(loan_amount), int(loan_term),
+                repayment_method, start_date.toordinal(), first_payment_date.toordinal(),
+                interest_frequency, self.calculation_mode, self.solver)
+    
+    def _fee_cashflow_equation(self, fee_amount, fee_frequency, schedule):
+        """
+        构建单项费用的现金流方程
         
-        # 定义现金流方程
-        def cashflow_equation(R):
-            # 左边：贷款本金 - 费用
-            left_side = loan_amount - fee_amount
-            
-            # 右边：所有还款的现值
-            right_side = 0
-            for payment_info in payment_schedule:
-                principal = payment_info['principal']
-                periods = payment_info['periods']
-                
-                # 计算整数期和小数期
-                st = int(periods)
-                ft = periods - st
-                
-                # 现值计算
-                if abs(R) < 1e-10:  # 避免除零
-                    discount = 1
-                else:
-                    discount = (1 + R) ** st * (1 + R * ft)
-                
-                right_side += principal / discount
-            
-            return left_side - right_side
+        返回:
+            (左边目标值, 金额数组, 整数期数组, 小数期数组, 初始猜测值)
+        """
+        if fee_frequency == "期初一次性付费":
+            # 期初一次性付费：贷款本金 - 费用 = 还款现值
+            target = schedule.loan_amount - fee_amount
+            initial_guess = fee_amount / schedule.loan_amount / schedule.loan_term * 12
+            return target, schedule.amounts, schedule.st, schedule.ft, initial_guess
         
-        # 求解单位周期费率
-        try:
-            # 初始猜测值
-            initial_guess = fee_amount / loan_amount / loan_term * 12
-            
-            # 使用fsolve求解
-            solution = fsolve(cashflow_equation, initial_guess, xtol=1e-10)
-            unit_period_rate = solution[0]
-            
-            # 转换为年化率（使用单利方式）
-            if unit_period == 1:  # 月
-                annual_rate = unit_period_rate * 12
-            elif unit_period == 3:  # 季
-                annual_rate = unit_period_rate * 4
-            elif unit_period == 6:  # 半年
-                annual_rate = unit_period_rate * 2
-            elif unit_period == 12:  # 年
-                annual_rate = unit_period_rate
-            else:  # 日
-                annual_rate = unit_period_rate * 360
-            
-            return max(0, annual_rate)  # 确保非负
-            
-        except:
-            # 如果求解失败，使用简化计算
-            return fee_amount / loan_amount / (loan_term / 12)
+        # 周期性付费：贷款本金 = 还款及费用现值
+        fee_amounts, fee_st, fee_ft = schedule.fee_arrays(fee_amount, fee_frequency)
+        amounts = np.concatenate((schedule.amounts, fee_amounts))
+        st = np.concatenate((schedule.st, fee_st))
+        ft = np.concatenate((schedule.ft, fee_ft))
+        
+        payments_per_year = self.fee_frequency_per_year.get(fee_frequency, 12)
+        initial_guess = fee_amount * payments_per_year / schedule.loan_amount / 12
+        return schedule.loan_amount, amounts, st, ft, initial_guess
     
-    def _calculate_periodic_fee_rate(self, fee_amount, fee_frequency, loan_amount, 
-                                     loan_term, repayment_method, start_date, 
-                                     first_payment_date, unit_period):
-        """计算周期性付费的年化率"""
-        # 计算还款现金流
-        payment_schedule = self._get_payment_schedule(
-            loan_amount, loan_term, repayment_method, 
-            start_date, first_payment_date, unit_period
-        )
+    def _solve_fee_equations(self, equations):
+        """
+        同时求解多个现金流方程
         
-        # 计算费用支付计划
-        fee_schedule = self._get_fee_payment_schedule(
-            fee_amount, fee_frequency, loan_term, start_date, first_payment_date
-        )
+        有解析解的方程直接计算，其余方程以金额0补齐为矩阵后迭代求解
+        """
+        n = len(equations)
+        rates = np.full(n, np.nan)
+        converged = np.zeros(n, dtype=bool)
+        iterations = np.zeros(n, dtype=int)
+        function_calls = np.zeros(n, dtype=int)
+        messages = np.full(n, "解析解", dtype=object)
         
-        # 定义现金流方程
-        def cashflow_equation(R):
-            # 左边：贷款本金
-            left_side = loan_amount
-            
-            # 右边：所有还款和费用的现值
-            right_side = 0
-            
-            # 还款现值
-            for payment_info in payment_schedule:
-                principal = payment_info['principal']
-                periods = payment_info['periods']
-                
-                # 计算整数期和小数期
-                st = int(periods)
-                ft = periods - st
-                
-                # 现值计算
-                if abs(R) < 1e-10:
-                    discount = 1
+        pending = []
+        polynomials = []  # (方程下标, 多项式系数)
+        for i, equation in enumerate(equations):
+            rate = self._closed_form_rate(equation)
+            if rate is None and self.solver == "polynomial":
+                coefficients = self._polynomial_coefficients(equation)
+                if coefficients is not None:
+                    polynomials.append((i, coefficients))
+                    continue
+            if rate is None:
+                pending.append(i)
+            else:
+                rates[i] = rate
+                converged[i] = True
+        
+        # 可化为多项式的方程同阶一起求根，未找到正根的仍用牛顿迭代
+        if polynomials:
+            polynomial_rates = self._polynomial_rates([coefficients for _, coefficients in polynomials])
+            for (i, _), rate in zip(polynomials, polynomial_rates):
+                if np.isnan(rate):
+                    pending.append(i)
                 else:
-                    discount = (1 + R) ** st * (1 + R * ft)
-                
-                right_side += principal / discount
+                    rates[i] = rate
+                    converged[i] = True
+                    messages[i] = "多项式求根"
+            pending.sort()
+        
+        if pending:
+            width = max(len(equations[i][1]) for i in pending)
+            amounts = np.zeros((len(pending), width))
+            st = np.zeros((len(pending), width))
+            ft = np.zeros((len(pending), width))
+            for row, i in enumerate(pending):
+                _, row_amounts, row_st, row_ft, _ = equations[i]
+                amounts[row, :len(row_amounts)] = row_amounts
+                st[row, :len(row_st)] = row_st
+                ft[row, :len(row_ft)] = row_ft
             
-            # 费用现值
-            for fee_info in fee_schedule:
-                fee_payment = fee_info['amount']
-                periods = fee_info['periods']
-                
-                # 计算整数期和小数期
-                st = int(periods)
-                ft = periods - st
-                
-                # 现值计算
-                if abs(R) < 1e-10:
-                    discount = 1
-                else:
-                    discount = (1 + R) ** st * (1 + R * ft)
-                
-                right_side += fee_payment / discount
+            targets = [equations[i][0] for i in pending]
+            initial_guesses = [equations[i][4] for i in pending]
+            result = solve_unit_period_rates(targets, amounts, st, ft, initial_guesses)
             
-            return left_side - right_side
+            rates[pending] = result.rate
+            converged[pending] = result.converged
+            iterations[pending] = result.iterations
+            function_calls[pending] = result.function_calls
+            messages[pending] = result.message
         
-        # 求解单位周期费率
-        try:
-            # 初始猜测值
-            payments_per_year = self.fee_frequency_per_year.get(fee_frequency, 12)
-            initial_guess = fee_amount * payments_per_year / loan_amount / 12
-            
-            # 使用fsolve求解
-            solution = fsolve(cashflow_equation, initial_guess, xtol=1e-10)
-            unit_period_rate = solution[0]
-            
-            # 转换为年化率（使用单利方式）
-            if unit_period == 1:  # 月
-                annual_rate = unit_period_rate * 12
-            elif unit_period == 3:  # 季
-                annual_rate = unit_period_rate * 4
-            elif unit_period == 6:  # 半年
-                annual_rate = unit_period_rate * 2
-            elif unit_period == 12:  # 年
-                annual_rate = unit_period_rate
-            else:  # 日
-                annual_rate = unit_period_rate * 360
-            
-            return max(0, annual_rate)  # 确保非负
+        return IRRResult(rates, converged, iterations, function_calls, messages)
+    
+    def _closed_form_rate(self, equation):
+        """
+        只有一笔还款现金流的方程 target = P / [(1+R)^st × (1+R×ft)]
+        在ft=0（整数期）或st=0时有解析解，如一次性还本贷款的期初一次性费用
+        
+        无解析解时返回None
+        """
+        target, amounts, st, ft, _ = equation
+        if len(amounts) != 1 or target <= 0 or amounts[0] <= 0:
+            return None
+        
+        ratio = amounts[0] / target
+        if ft[0] == 0 and st[0] > 0:
+            # (1+R)^st = P / target
+            return ratio ** (1 / st[0]) - 1
+        if st[0] == 0 and ft[0] > 0:
+            # 1 + R×ft = P / target
+            return (ratio - 1) / ft[0]
+        return None
+    
+    def _polynomial_coefficients(self, equation):
+        """
+        期数均为整数时，令 x = 1/(1+R)，现金流方程化为多项式
+        Σ c_k × x^k - target = 0（c_k 为第k期现金流之和），
+        各项系数非负而常数项为负，有唯一正根
+        
+        返回按x升幂排列的系数；不适用或次数超过POLYNOMIAL_MAX_DEGREE时返回None
+        """
+        target, amounts, st, ft, _ = equation
+        if np.any(ft != 0) or np.any(st < 0) or target <= 0:
+            return None
+        if st.max(initial=0) > self.POLYNOMIAL_MAX_DEGREE:
+            return None
+        
+        coefficients = np.bincount(st.astype(int), weights=amounts)
+        nonzero = np.flatnonzero(coefficients)
+        if len(nonzero) == 0 or nonzero[-1] == 0:
+            return None
+        coefficients = coefficients[:nonzero[-1] + 1]  # 去掉末尾为0的高次项
+        coefficients[0] -= target
+        if coefficients[0] >= 0:
+            return None
+        return coefficients
+    
+    def _polynomial_rates(self, polynomials):
+        """
+        多项式批量求根：同次数的多项式组成伴随矩阵组，一次求出全部特征值（即多项式的根）
+        
+        返回各多项式对应的R，未找到正根的为nan
+        """
+        rates = np.full(len(polynomials), np.nan)
+        degrees = np.array([len(coefficients) - 1 for coefficients in polynomials])
+        for degree in np.unique(degrees):
+            rows = np.flatnonzero(degrees == degree)
+            coefficients = np.array([polynomials[i] for i in rows])
             
-        except:
-            # 如果求解失败，使用简化计算
-            payments_per_year = self.fee_frequency_per_year.get(fee_frequency, 0)
-            if payments_per_year > 0:
-                return fee_amount * payments_per_year / loan_amount
-            else:
-                return fee_amount / loan_amount / (loan_term / 12)
+            # 伴随矩阵：次对角线为1，最后一列为 -c_k / c_degree
+            companion = np.zeros((len(rows), degree, degree))
+            companion[:, np.arange(1, degree), np.arange(degree - 1)] = 1
+            companion[:, :, -1] = -coefficients[:, :-1] / coefficients[:, -1:]
+            roots = np.linalg.eigvals(companion)
+            
+            # 数值误差可能产生多个近似正根，取最接近1（R最接近0）的根
+            real = (np.abs(roots.imag) <= 1e-8 * np.abs(roots)) & (roots.real > 0)
+            distance = np.where(real, np.abs(roots.real - 1), np.inf)
+            best = np.argmin(distance, axis=1)
+            found = real[np.arange(len(rows)), best]
+            x = roots.real[np.arange(len(rows)), best]
+            rates[rows[found]] = 1 / x[found] - 1
+        return rates
+    
+    def _periods_per_year(self, unit_period):
+        """单位周期对应的年内周期数n（年化率 = n × R）"""
+        if unit_period == 1:  # 月
+            return 12
+        elif unit_period == 3:  # 季
+            return 4
+        elif unit_period == 6:  # 半年
+            return 2
+        elif unit_period == 12:  # 年
+            return 1
+        else:  # 日
+            return 360
     
     def _get_payment_schedule(self, loan_amount, loan_term, repayment_method, 
                               start_date, first_payment_date, unit_period):
-        """获取还款计划"""
-        schedule = []
-        
+        """获取还款计划（CashFlowSchedule，金额为每期本金）"""
         # 确定实际使用的计算模式
         if self.calculation_mode == "auto":
             use_integer = self._should_use_integer_mode(start_date, first_payment_date)
@@ -307,169 +837,80 @@ class FinanceCostCalculator:
             # 等额本息需要精确计算每期本金
             # 假设一个合理的月利率用于计算（这里用5%年利率作为参考）
             monthly_rate = 0.05 / 12
+            month_offsets = np.arange(loan_term)
             
             if monthly_rate == 0:
                 # 无利率情况下，等额本息退化为等额本金
-                principal_per_period = loan_amount / loan_term
-                for i in range(loan_term):
-                    payment_date = first_payment_date + relativedelta(months=i)
-                    
-                    # 根据计算模式决定期数
-                    if use_integer:
-                        periods = i + 1  # 使用整数期数
-                    else:
-                        periods = self._calculate_periods(start_date, payment_date, unit_period)
-                    
-                    schedule.append({
-                        'date': payment_date,
-                        'principal': principal_per_period,
-                        'periods': periods
-                    })
+                principals = np.full(loan_term, loan_amount / loan_term)
             else:
                 # 计算等额本息每月还款额
                 monthly_payment = loan_amount * monthly_rate * (1 + monthly_rate) ** loan_term / ((1 + monthly_rate) ** loan_term - 1)
                 
+                principals = np.empty(loan_term)
                 remaining_principal = loan_amount
                 for i in range(loan_term):
-                    payment_date = first_payment_date + relativedelta(months=i)
-                    
-                    # 根据计算模式决定期数
-                    if use_integer:
-                        periods = i + 1  # 使用整数期数
-                    else:
-                        periods = self._calculate_periods(start_date, payment_date, unit_period)
-                    
-                    # 当期利息
-                    interest = remaining_principal * monthly_rate
-                    
                     # 当期本金 = 月还款额 - 当期利息
-                    principal = monthly_payment - interest
+                    principal = monthly_payment - remaining_principal * monthly_rate
                     
                     # 避免最后一期的舍入误差
                     if i == loan_term - 1:
                         principal = remaining_principal
                     
-                    schedule.append({
-                        'date': payment_date,
-                        'principal': principal,
-                        'periods': periods
-                    })
-                    
+                    principals[i] = principal
                     remaining_principal -= principal
                 
-        elif repayment_method == "等额本金":
-            # 每期本金相同
-            principal_per_period = loan_amount / loan_term
-            
-            for i in range(loan_term):
-                payment_date = first_payment_date + relativedelta(months=i)
-                
-                # 根据计算模式决定期数
-                if use_integer:
-                    periods = i + 1  # 使用整数期数
-                else:
-                    periods = self._calculate_periods(start_date, payment_date, unit_period)
-                
-                schedule.append({
-                    'date': payment_date,
-                    'principal': principal_per_period,
-                    'periods': periods
-                })
-                
         elif repayment_method == "一次性还本":
             # 最后一期还本
-            last_payment_date = first_payment_date + relativedelta(months=loan_term-1)
-            
-            # 根据计算模式决定期数
-            if use_integer:
-                periods = loan_term  # 使用整数期数
-            else:
-                periods = self._calculate_periods(start_date, last_payment_date, unit_period)
-            
-            schedule.append({
-                'date': last_payment_date,
-                'principal': loan_amount,
-                'periods': periods
-            })
+            month_offsets = np.array([loan_term - 1])
+            principals = np.array([float(loan_amount)])
         
         else:
-            # 处理自定义还款方式，默认按等额本金处理
-            principal_per_period = loan_amount / loan_term
-            
-            for i in range(loan_term):
-                payment_date = first_payment_date + relativedelta(months=i)
-                
-                # 根据计算模式决定期数
-                if use_integer:
-                    periods = i + 1  # 使用整数期数
-                else:
-                    periods = self._calculate_periods(start_date, payment_date, unit_period)
-                
-                schedule.append({
-                    'date': payment_date,
-                    'principal': principal_per_period,
-                    'periods': periods
-                })
+            # 等额本金每期本金相同；自定义还款方式默认按等额本金处理
+            month_offsets = np.arange(loan_term)
+            principals = np.full(loan_term, loan_amount / loan_term)
+        
+        schedule = CashFlowSchedule(first_payment_date, month_offsets, principals)
+        
+        # 根据计算模式决定期数
+        if use_integer:
+            schedule.periods = (month_offsets + 1).astype(float)  # 使用整数期数
+        else:
+            schedule.periods = self._calculate_periods(start_date, schedule.dates, unit_period)
         
         return schedule
     
     def _get_fee_payment_schedule(self, fee_amount, fee_frequency, loan_term, 
                                   start_date, first_payment_date):
-        """获取费用支付计划"""
-        schedule = []
-        
+        """获取费用支付计划（CashFlowSchedule，期数以月为单位）"""
         if fee_frequency == "月":
             # 每月支付
-            for i in range(loan_term):
-                payment_date = start_date + relativedelta(months=i)
-                periods = i  # 月为单位
-                
-                schedule.append({
-                    'date': payment_date,
-                    'amount': fee_amount,
-                    'periods': periods
-                })
-                
+            month_offsets = np.arange(loan_term)
         elif fee_frequency == "季":
             # 每季度支付
-            num_payments = loan_term // 3
-            for i in range(num_payments):
-                payment_date = start_date + relativedelta(months=i*3)
-                periods = i * 3  # 月为单位
-                
-                schedule.append({
-                    'date': payment_date,
-                    'amount': fee_amount,
-                    'periods': periods
-                })
-                
+            month_offsets = np.arange(loan_term // 3) * 3
         elif fee_frequency == "年":
             # 每年支付
-            num_payments = loan_term // 12
-            for i in range(num_payments):
-                payment_date = start_date + relativedelta(months=i*12)
-                periods = i * 12  # 月为单位
-                
-                schedule.append({
-                    'date': payment_date,
-                    'amount': fee_amount,
-                    'periods': periods
-                })
+            month_offsets = np.arange(loan_term // 12) * 12
+        else:
+            month_offsets = np.arange(0)
         
-        return schedule
+        amounts = np.full(len(month_offsets), float(fee_amount))
+        return CashFlowSchedule(start_date, month_offsets, amounts, month_offsets.astype(float))
     
-    def _calculate_periods(self, start_date, end_date, unit_period):
-        """计算两个日期之间的期数"""
-        # 计算天数差
-        days_diff = (end_date - start_date).days
+    def _calculate_periods(self, start_date, end_dates, unit_period):
+        """计算起始日到各日期（datetime64[D]数组）之间的期数"""
+        start = np.datetime64(start_date, 'D')
         
         if unit_period == 1:  # 月
             # 计算月数差
-            years_diff = end_date.year - start_date.year
-            months_diff = end_date.month - start_date.month
-            days_adjust = (end_date.day - start_date.day) / 30.0
-            return years_diff * 12 + months_diff + days_adjust
-        elif unit_period == 12:  # 年
+            months_diff = (end_dates.astype('datetime64[M]') - start.astype('datetime64[M]')).astype(int)
+            days = (end_dates - end_dates.astype('datetime64[M]').astype('datetime64[D]')).astype(int) + 1
+            days_adjust = (days - start_date.day) / 30.0
+            return months_diff + days_adjust
+        
+        # 计算天数差
+        days_diff = (end_dates - start).astype(int)
+        if unit_period == 12:  # 年
             return days_diff / 360.0
         else:
             # 其他情况按天数比例计算
@@ -477,10 +918,17 @@ class FinanceCostCalculator:
     
     def calculate_loan_cash_flows(self, loan_amount, repayment_method, loan_term, 
                                  interest_frequency, interest_rate, 
-                                 start_date, end_date, first_payment_date):
+                                 start_date, end_date, first_payment_date, schedule=None):
         """计算贷款本息现金流（保留用于显示）"""
         cash_flows = defaultdict(float)
         
+        # 还款日期取自该笔贷款的还款计划
+        if schedule is None:
+            schedule = self.build_payment_schedule(
+                loan_amount, loan_term, repayment_method,
+                start_date, first_payment_date, interest_frequency
+            )
+        
         # 贷款发放，现金流入为正
         cash_flows[start_date] = loan_amount
         
@@ -496,7 +944,7 @@ class FinanceCostCalculator:
                 monthly_payment = loan_amount * monthly_rate * (1 + monthly_rate) ** loan_term / ((1 + monthly_rate) ** loan_term - 1)
             
             # 根据付息频率确定还款日期
-            payment_dates = self.generate_payment_dates(first_payment_date, loan_term, self.frequency_periods[interest_frequency])
+            payment_dates = schedule.payment_dates(self.frequency_periods[interest_frequency])
             
             # 每期还款
             for payment_date in payment_dates:
@@ -507,7 +955,7 @@ class FinanceCostCalculator:
             principal_per_period = loan_amount / loan_term
             
             # 根据付息频率确定还款日期
-            payment_dates = self.generate_payment_dates(first_payment_date, loan_term, self.frequency_periods[interest_frequency])
+            payment_dates = schedule.payment_dates(self.frequency_periods[interest_frequency])
             
             # 计算每期利息和本金
             remaining_principal = loan_amount
@@ -526,7 +974,7 @@ class FinanceCostCalculator:
                 
         elif repayment_method == "一次性还本":
             # 根据付息频率计算利息支付日期
-            interest_dates = self.generate_payment_dates(first_payment_date, loan_term, self.frequency_periods[interest_frequency])
+            interest_dates = schedule.payment_dates(self.frequency_periods[interest_frequency])
             
             # 计算每期利息
             period_interest = loan_amount * (interest_rate / 12)
@@ -659,4 +1107,112 @@ class FinanceCostCalculator:
                 days_to_add = int(period_months * 30)
                 current_date = current_date + relativedelta(days=days_to_add)
         
-        return payment_dates 
\ No newline at end of file
+        return payment_dates 
+
+def _calculate_batch_task(calculation_mode, solver, loan_columns, fee_columns, chunk_size):
+    """进程池任务：在子进程中批量计算一块贷款"""
+    calculator = FinanceCostCalculator(calculation_mode, solver)
+    total_costs, fee_annual_rates = calculator.calculate_finance_cost_batch(
+        *loan_columns, *fee_columns, chunk_size=chunk_size
+    )
+    return total_costs, fee_annual_rates, calculator.last_batch_errors
+
+
+class ParallelCostCalculator:
+    """
+    多进程批量计算器
+    将一组贷款按顺序分块后分发到进程池并行计算，结果按原顺序合并
+    
+    进程池在首次需要时创建并在多次批量计算间复用（子进程只启动、导入一次），用完后调用close关闭
+    """
+    def __init__(self, calculator=None, max_workers=None, loans_per_task=2000):
+        """
+        参数:
+            calculator: 提供计算模式及求解方法的FinanceCostCalculator，缺省为自动模式
+            max_workers: 进程数，缺省为CPU核数；为1时在当前进程内计算
+            loans_per_task: 每个任务包含的贷款笔数，贷款笔数不超过该值时不启用进程池
+        """
+        self.calculator = calculator if calculator is not None else FinanceCostCalculator()
+        self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self.loans_per_task = loans_per_task
+        
+        # 最近一次批量计算中失败的贷款（贷款下标 -> 错误信息）
+        self.last_batch_errors = {}
+        
+        self._executor = None
+    
+    def close(self):
+        """关闭进程池，之后再次批量计算时重新创建"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+    
+    def calculate_finance_cost_batch(self, loan_amounts, repayment_methods, loan_terms,
+                                     interest_frequencies, interest_rates, start_dates,
+                                     end_dates, first_payment_dates, fee_loan_index=(),
+                                     fee_amounts=(), fee_frequencies=(), fee_is_bank_bearing=(),
+                                     chunk_size=1024):
+        """
+        参数及返回值与FinanceCostCalculator.calculate_finance_cost_batch相同
+        """
+        loan_columns = [list(column) for column in (
+            loan_amounts, repayment_methods, loan_terms, interest_frequencies,
+            interest_rates, start_dates, end_dates, first_payment_dates
+        )]
+        fee_loan_index = np.asarray(fee_loan_index, dtype=int)
+        if len(fee_is_bank_bearing) == 0:
+            fee_is_bank_bearing = np.zeros(len(fee_loan_index), dtype=int)
+        fee_columns = [np.asarray(fee_amounts, dtype=float), list(fee_frequencies),
+                       np.asarray(fee_is_bank_bearing, dtype=int)]
+        
+        num_loans = len(loan_columns[0])
+        if self.max_workers <= 1 or num_loans <= self.loans_per_task:
+            total_costs, fee_annual_rates = self.calculator.calculate_finance_cost_batch(
+                *loan_columns, fee_loan_index, *fee_columns, chunk_size=chunk_size
+            )
+            self.last_batch_errors = dict(self.calculator.last_batch_errors)
+            return total_costs, fee_annual_rates
+        
+        # 按贷款顺序分块，费用表随所属贷款拆分，下标改为块内下标
+        bounds = list(range(0, num_loans, self.loans_per_task)) + [num_loans]
+        tasks = []
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            rows = np.flatnonzero((fee_loan_index >= lo) & (fee_loan_index < hi))
+            tasks.append((
+                lo, hi, rows,
+                [column[lo:hi] for column in loan_columns],
+                [fee_loan_index[rows] - lo] + [
+                    column[rows] if isinstance(column, np.ndarray) else [column[i] for i in rows]
+                    for column in fee_columns
+                ]
+            ))
+        
+        total_costs = np.empty(num_loans)
+        fee_annual_rates = np.empty(len(fee_loan_index))
+        self.last_batch_errors = {}
+        
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = [
+                self._executor.submit(
+                    _calculate_batch_task,
+                    self.calculator.calculation_mode, self.calculator.solver,
+                    task_loans, task_fees, chunk_size
+                )
+                for _, _, _, task_loans, task_fees in tasks
+            ]
+            # 按提交顺序取回结果，保证与输入顺序一致
+            for (lo, hi, rows, _, _), future in zip(tasks, futures):
+                task_costs, task_fee_rates, task_errors = future.result()
+                total_costs[lo:hi] = task_costs
+                fee_annual_rates[rows] = task_fee_rates
+                for loan_id, message in task_errors.items():
+                    self.last_batch_errors[lo + loan_id] = message
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可再用，下次批量计算时重新创建
+            self._executor = None
+            raise
+        
+        self.last_batch_errors = dict(sorted(self.last_batch_errors.items()))
+        return total_costs, fee_annual_rates
@@ -1,101 +1,99 @@
 import sqlite3
 import json
-import os
+import hashlib
+import threading
 import uuid  # 添加uuid导入
+from contextlib import contextmanager
+from models import Fee, FinanceRecord, SUMMARY_CATEGORIES
 
 class RecordManager:
-    def __init__(self, db_file):
-        """初始化数据库管理器"""
+    def __init__(self, db_file, journal_mode="WAL"):
+        """
+        初始化数据库管理器
+        
+        journal_mode: 日志模式，缺省WAL（保存时导出等读操作不被阻塞）；
+            无法切换到该模式时（如数据库位于网络共享目录）退回SQLite默认的DELETE模式
+        """
         self.db_file = db_file
+        self.journal_mode = journal_mode.upper()
+        
+        # 每个线程复用一个长连接，避免每次操作重新连接数据库
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        
         self.init_database()
     
+    def _connection(self):
+        """获取当前线程的数据库连接，首次使用时创建"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # cached_statements: 连接内缓存已编译的SQL语句，重复执行时无需重新解析
+            conn = sqlite3.connect(self.db_file, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA foreign_keys = ON")
+            if self.journal_mode == "WAL":
+                conn.execute("PRAGMA synchronous = NORMAL")   # WAL模式下NORMAL即可保证一致性
+            conn.execute("PRAGMA cache_size = -16000")    # 页缓存约16MB
+            conn.execute("PRAGMA temp_store = MEMORY")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+    
+    @contextmanager
+    def transaction(self):
+        """写事务：正常结束时提交，发生异常时回滚"""
+        conn = self._connection()
+        try:
+            yield conn.cursor()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def close(self):
+        """关闭全部线程的数据库连接"""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+    
     def init_database(self):
-        """初始化数据库结构"""
-        # 如果数据库文件不存在，创建表结构
-        is_new_db = not os.path.exists(self.db_file)
-        conn = sqlite3.connect(self.db_file)
-        conn.execute("PRAGMA foreign_keys = ON")
-        cursor = conn.cursor()
-        
-        if is_new_db:
-            # 创建记录表 - 全新创建
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS finance_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uuid TEXT UNIQUE,
-                company_name TEXT,
-                loan_amount REAL,
-                repayment_method TEXT,
-                loan_term INTEGER,
-                interest_frequency TEXT,
-                start_date TEXT,
-                end_date TEXT,
-                first_payment_date TEXT,
-                interest_rate REAL,
-                total_cost REAL,
-                loan_channel TEXT,
-                customer_type TEXT,
-                company_nature TEXT,
-                guarantee_type TEXT,
-                loan_type TEXT,
-                application_method TEXT,
-                is_subsidized INTEGER,
-                create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            ''')
-            
-            # 创建费用表 - 全新创建
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS finance_fees (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                record_id INTEGER,
-                name TEXT,
-                amount REAL,
-                frequency TEXT,
-                is_bank_bearing INTEGER DEFAULT 0,
-                FOREIGN KEY (record_id) REFERENCES finance_records (id) ON DELETE CASCADE
-            )
-            ''')
-        else:
-            # 检查已有表结构，添加缺失的列
-            # 检查finance_records表
-            cursor.execute("PRAGMA table_info(finance_records)")
-            columns = {row[1] for row in cursor.fetchall()}
-            
-            # 需要添加的新列
-            new_columns = {
-                "uuid": "TEXT",  # 移除UNIQUE约束，因为ALTER TABLE不能添加UNIQUE列
-                "loan_channel": "TEXT",
-                "customer_type": "TEXT",
-                "company_nature": "TEXT", 
-                "guarantee_type": "TEXT",
-                "loan_type": "TEXT",
-                "application_method": "TEXT",
-                "is_subsidized": "INTEGER"
-            }
-            
-            # 添加缺失的列
-            for col_name, col_type in new_columns.items():
-                if col_name not in columns:
-                    cursor.execute(f"ALTER TABLE finance_records ADD COLUMN {col_name} {col_type}")
-            
-            # 为现有记录生成UUID（如果还没有的话）
-            cursor.execute("SELECT id FROM finance_records WHERE uuid IS NULL OR uuid = ''")
-            for row in cursor.fetchall():
-                record_id = row[0]
-                new_uuid = str(uuid.uuid4())
-                cursor.execute("UPDATE finance_records SET uuid = ? WHERE id = ?", (new_uuid, record_id))
-            
-            # 检查finance_fees表
-            cursor.execute("PRAGMA table_info(finance_fees)")
-            fee_columns = {row[1] for row in cursor.fetchall()}
-            
-            # 为费用表添加是否银行承担字段
-            if "is_bank_bearing" not in fee_columns:
-                cursor.execute("ALTER TABLE finance_fees ADD COLUMN is_bank_bearing INTEGER DEFAULT 0")
+        """初始化数据库结构：依次执行尚未执行过的迁移，已是最新版本时不做任何检查"""
+        conn = self._connection()
+        
+        # 日志模式写入数据库文件，对之后的所有连接生效；切换失败时SQLite返回原模式或报错，退回DELETE模式
+        try:
+            mode = conn.execute(f"PRAGMA journal_mode = {self.journal_mode}").fetchone()[0].upper()
+        except sqlite3.OperationalError:
+            mode = None
+        if mode != self.journal_mode:
+            self.journal_mode = "DELETE"
+            conn.execute("PRAGMA journal_mode = DELETE")
+            conn.execute("PRAGMA synchronous = FULL")   # 本连接创建时按WAL设置了NORMAL，恢复默认
         
-        conn.commit()
-        conn.close()
+        # 数据库结构版本记录在PRAGMA user_version中，新库及旧版程序创建的库为0
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target_version, migration in enumerate(_MIGRATIONS, start=1):
+            if target_version <= version:
+                continue
+            # 每个迁移在一个事务内完成，连同版本号一起提交（显式BEGIN使建表、加列也在事务内）
+            with self.transaction() as cursor:
+                cursor.execute("BEGIN")
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {target_version}")
+        
+        # 新建汇总表后或分类规则、触发器有变化时，重建触发器并重新计算汇总数据
+        signature = _summary_signature()
+        row = conn.execute("SELECT value FROM summary_settings WHERE name = 'signature'").fetchone()
+        if row is None or row[0] != signature:
+            with self.transaction() as cursor:
+                cursor.execute("BEGIN")
+                _rebuild_summary_aggregates(cursor)
+                cursor.execute("INSERT OR REPLACE INTO summary_settings (name, value) VALUES ('signature', ?)",
+                               (signature,))
     
     def add_record(self, company_name, loan_amount, repayment_method, loan_term,
                   interest_frequency, start_date, end_date, first_payment_date,
@@ -103,11 +101,7 @@ class RecordManager:
                   company_nature="", guarantee_type="", loan_type="", 
                   application_method="", is_subsidized=0):
         """添加新记录"""
-        conn = sqlite3.connect(self.db_file)
-        conn.execute("PRAGMA foreign_keys = ON")
-        cursor = conn.cursor()
-        
-        try:
+        with self.transaction() as cursor:
             # 生成UUID
             record_uuid = str(uuid.uuid4())
             
@@ -133,22 +127,81 @@ class RecordManager:
             
             # 插入费用记录
             for fee in fees:
-                # 检查是否有银行承担字段
-                is_bank_bearing = fee.get("is_bank_bearing", 0)
-                
                 cursor.execute('''
                 INSERT INTO finance_fees (record_id, name, amount, frequency, is_bank_bearing)
                 VALUES (?, ?, ?, ?, ?)
-                ''', (record_id, fee["name"], fee["amount"], fee["frequency"], is_bank_bearing))
+                ''', (record_id, fee.name, fee.amount, fee.frequency, fee.is_bank_bearing))
             
-            conn.commit()
             return record_id
+    
+    def upsert_records_bulk(self, records):
+        """
+        在一个事务内按UUID批量写入记录：UUID已存在的更新原记录并替换其费用项，否则新增
+        
+        records: FinanceRecord列表（含total_cost及fees），没有uuid的生成新UUID，写入后回填id
+        同一UUID出现多次时以最后一条为准
+        返回: 记录ID列表，与records顺序一致
+        """
+        if not records:
+            return []
+        
+        for record in records:
+            if not record.uuid:
+                record.uuid = str(uuid.uuid4())
+        unique_records = list({record.uuid: record for record in records}.values())
+        
+        with self.transaction() as cursor:
+            cursor.executemany('''
+            INSERT INTO finance_records (
+                uuid, company_name, loan_amount, repayment_method, loan_term,
+                interest_frequency, start_date, end_date, first_payment_date,
+                interest_rate, total_cost, loan_channel, customer_type,
+                company_nature, guarantee_type, loan_type, application_method,
+                is_subsidized
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(uuid) DO UPDATE SET
+                company_name = excluded.company_name, loan_amount = excluded.loan_amount,
+                repayment_method = excluded.repayment_method, loan_term = excluded.loan_term,
+                interest_frequency = excluded.interest_frequency, start_date = excluded.start_date,
+                end_date = excluded.end_date, first_payment_date = excluded.first_payment_date,
+                interest_rate = excluded.interest_rate, total_cost = excluded.total_cost,
+                loan_channel = excluded.loan_channel, customer_type = excluded.customer_type,
+                company_nature = excluded.company_nature, guarantee_type = excluded.guarantee_type,
+                loan_type = excluded.loan_type, application_method = excluded.application_method,
+                is_subsidized = excluded.is_subsidized
+            ''', [(
+                record.uuid, record.company_name, record.loan_amount, record.repayment_method,
+                record.loan_term, record.interest_frequency, record.start_date, record.end_date,
+                record.first_payment_date, record.interest_rate, record.total_cost,
+                record.loan_channel, record.customer_type, record.company_nature,
+                record.guarantee_type, record.loan_type, record.application_method,
+                record.is_subsidized
+            ) for record in unique_records])
             
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            # 按UUID索引取回ID（更新的记录沿用原ID）
+            ids_by_uuid = {}
+            uuids = [record.uuid for record in unique_records]
+            for i in range(0, len(uuids), 500):
+                batch = uuids[i:i + 500]
+                cursor.execute(f'''
+                SELECT uuid, id FROM finance_records WHERE uuid IN ({", ".join("?" * len(batch))})
+                ''', batch)
+                ids_by_uuid.update(cursor.fetchall())
+            for record in records:
+                record.id = ids_by_uuid[record.uuid]
+            
+            # 替换费用记录
+            cursor.executemany('DELETE FROM finance_fees WHERE record_id = ?',
+                               [(record.id,) for record in unique_records])
+            cursor.executemany('''
+            INSERT INTO finance_fees (record_id, name, amount, frequency, is_bank_bearing)
+            VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (record.id, fee.name, fee.amount, fee.frequency, fee.is_bank_bearing)
+                for record in unique_records for fee in record.fees
+            ])
+        
+        return [record.id for record in records]
     
     def update_record(self, record_id, company_name, loan_amount, repayment_method, loan_term,
                      interest_frequency, start_date, end_date, first_payment_date,
@@ -156,11 +209,7 @@ class RecordManager:
                      company_nature="", guarantee_type="", loan_type="", 
                      application_method="", is_subsidized=0):
         """更新记录"""
-        conn = sqlite3.connect(self.db_file)
-        conn.execute("PRAGMA foreign_keys = ON")
-        cursor = conn.cursor()
-        
-        try:
+        with self.transaction() as cursor:
             # 更新主记录
             cursor.execute('''
             UPDATE finance_records SET
@@ -183,113 +232,687 @@ class RecordManager:
             
             # 插入新的费用记录
             for fee in fees:
-                # 检查是否有银行承担字段
-                is_bank_bearing = fee.get("is_bank_bearing", 0)
-                
                 cursor.execute('''
                 INSERT INTO finance_fees (record_id, name, amount, frequency, is_bank_bearing)
                 VALUES (?, ?, ?, ?, ?)
-                ''', (record_id, fee["name"], fee["amount"], fee["frequency"], is_bank_bearing))
-            
-            conn.commit()
-            
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+                ''', (record_id, fee.name, fee.amount, fee.frequency, fee.is_bank_bearing))
+    
+    def update_total_costs(self, total_costs):
+        """批量更新综合融资成本 [(record_id, total_cost), ...]"""
+        with self.transaction() as cursor:
+            cursor.executemany(
+                'UPDATE finance_records SET total_cost = ? WHERE id = ?',
+                [(total_cost, record_id) for record_id, total_cost in total_costs]
+            )
+    
+    def get_cached_results(self, fingerprints, calculator_version):
+        """
+        读取计算结果缓存
+        
+        返回 {指纹: (综合融资成本, [费用年化率, ...])}，只包含版本一致的结果
+        """
+        cursor = self._connection().cursor()
+        
+        results = {}
+        fingerprints = list(fingerprints)
+        # 分批查询，避免超出SQLite参数个数限制
+        for i in range(0, len(fingerprints), 500):
+            batch = fingerprints[i:i + 500]
+            cursor.execute(f'''
+            SELECT fingerprint, total_cost, fee_annual_rates FROM finance_result_cache
+            WHERE calculator_version = ? AND fingerprint IN ({", ".join("?" * len(batch))})
+            ''', [calculator_version] + batch)
+            for fingerprint, total_cost, fee_annual_rates in cursor.fetchall():
+                results[fingerprint] = (total_cost, json.loads(fee_annual_rates))
+        
+        return results
+    
+    def save_cached_results(self, results, calculator_version):
+        """保存计算结果缓存 [(指纹, 综合融资成本, [费用年化率, ...]), ...]"""
+        with self.transaction() as cursor:
+            cursor.executemany('''
+            INSERT OR REPLACE INTO finance_result_cache
+                (fingerprint, calculator_version, total_cost, fee_annual_rates)
+            VALUES (?, ?, ?, ?)
+            ''', [
+                (fingerprint, calculator_version, total_cost, json.dumps(fee_annual_rates))
+                for fingerprint, total_cost, fee_annual_rates in results
+            ])
+    
+    def delete_cached_results(self, fingerprints):
+        """删除指定输入指纹的计算结果缓存（记录的输入被修改后，旧输入的结果不再使用）"""
+        with self.transaction() as cursor:
+            cursor.executemany('DELETE FROM finance_result_cache WHERE fingerprint = ?',
+                               [(fingerprint,) for fingerprint in fingerprints])
+    
+    def clear_cached_results(self, keep_version=None):
+        """清除计算结果缓存，keep_version不为None时保留该版本的结果"""
+        with self.transaction() as cursor:
+            if keep_version is None:
+                cursor.execute('DELETE FROM finance_result_cache')
+            else:
+                cursor.execute('DELETE FROM finance_result_cache WHERE calculator_version != ?',
+                               (keep_version,))
     
     def delete_record(self, record_id):
         """删除记录"""
-        conn = sqlite3.connect(self.db_file)
-        conn.execute("PRAGMA foreign_keys = ON")
-        cursor = conn.cursor()
-        
-        try:
+        with self.transaction() as cursor:
             # 删除主记录，费用记录会通过外键级联删除
             cursor.execute('DELETE FROM finance_records WHERE id = ?', (record_id,))
-            conn.commit()
-            
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
     
     def get_record(self, record_id):
-        """获取单条记录"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        """获取单条记录（FinanceRecord）"""
+        cursor = self._connection().cursor()
         
-        try:
-            # 查询主记录
+        # 查询主记录
+        cursor.execute('''
+        SELECT * FROM finance_records WHERE id = ?
+        ''', (record_id,))
+        
+        record = cursor.fetchone()
+        
+        if record:
+            # 查询关联的费用记录
             cursor.execute('''
-            SELECT * FROM finance_records WHERE id = ?
+            SELECT * FROM finance_fees WHERE record_id = ?
             ''', (record_id,))
             
-            record = cursor.fetchone()
-            
-            if record:
-                # 转换为字典
-                record_dict = dict(record)
-                
-                # 查询关联的费用记录
-                cursor.execute('''
-                SELECT * FROM finance_fees WHERE record_id = ?
-                ''', (record_id,))
-                
-                fees = [dict(fee) for fee in cursor.fetchall()]
-                record_dict["fees"] = fees
-                
-                return record_dict
-            else:
-                return None
-            
-        finally:
-            conn.close()
+            fees = [Fee.from_row(fee) for fee in cursor.fetchall()]
+            return FinanceRecord.from_row(record, fees)
+        else:
+            return None
+    
+    def get_records_by_uuid(self, uuids):
+        """按UUID批量获取记录，返回 {uuid: FinanceRecord}（不存在的UUID不包含在内）"""
+        cursor = self._connection().cursor()
+        
+        records_by_id = {}
+        uuids = list(uuids)
+        for i in range(0, len(uuids), 500):
+            batch = uuids[i:i + 500]
+            cursor.execute(f'''
+            SELECT * FROM finance_records WHERE uuid IN ({", ".join("?" * len(batch))})
+            ''', batch)
+            for row in cursor.fetchall():
+                records_by_id[row["id"]] = FinanceRecord.from_row(row)
+        
+        record_ids = list(records_by_id)
+        for i in range(0, len(record_ids), 500):
+            batch = record_ids[i:i + 500]
+            cursor.execute(f'''
+            SELECT * FROM finance_fees WHERE record_id IN ({", ".join("?" * len(batch))})
+            ORDER BY record_id, id
+            ''', batch)
+            for fee in cursor.fetchall():
+                records_by_id[fee["record_id"]].fees.append(Fee.from_row(fee))
+        
+        return {record.uuid: record for record in records_by_id.values()}
     
     def get_all_records(self):
         """获取所有记录"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self._connection().cursor()
         
-        try:
-            # 查询所有主记录
-            cursor.execute('''
-            SELECT * FROM finance_records ORDER BY id DESC
-            ''')
-            
-            records = [dict(record) for record in cursor.fetchall()]
-            
-            # 查询每条记录关联的费用
-            for record in records:
-                cursor.execute('''
-                SELECT * FROM finance_fees WHERE record_id = ?
-                ''', (record["id"],))
-                
-                fees = [dict(fee) for fee in cursor.fetchall()]
-                record["fees"] = fees
+        # 查询所有主记录
+        cursor.execute('''
+        SELECT * FROM finance_records ORDER BY id DESC
+        ''')
+        
+        records = [FinanceRecord.from_row(record) for record in cursor.fetchall()]
+        records_by_id = {record.id: record for record in records}
+        
+        # 一次查询全部费用，按所属记录分组
+        cursor.execute('''
+        SELECT * FROM finance_fees ORDER BY record_id, id
+        ''')
+        
+        for fee in cursor:
+            record = records_by_id.get(fee["record_id"])
+            if record is not None:
+                record.fees.append(Fee.from_row(fee))
+        
+        return records
+    
+    def count_records(self, record_ids=None):
+        """记录数，record_ids不为None时只统计其中存在的记录"""
+        where, params = _record_filter(record_ids)
+        cursor = self._connection().cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM finance_records {where}", params)
+        return cursor.fetchone()[0]
+    
+    def max_fee_count(self, record_ids=None):
+        """单条记录的最多费用项数"""
+        where, params = _record_filter(record_ids)
+        cursor = self._connection().cursor()
+        cursor.execute(f'''
+        SELECT MAX(fee_count) FROM (
+            SELECT COUNT(*) AS fee_count FROM finance_fees
+            WHERE record_id IN (SELECT id FROM finance_records {where})
+            GROUP BY record_id
+        )
+        ''', params)
+        return cursor.fetchone()[0] or 0
+    
+    def iter_record_batches(self, record_ids=None, batch_size=1000):
+        """
+        按ID倒序分批读取记录（含费用项），每批为不超过batch_size条的FinanceRecord列表
+        
+        record_ids: 只读取这些记录，为None时读取全部记录
+        每次只从游标取出一批记录并查询其费用，内存占用与记录总数无关
+        """
+        where, params = _record_filter(record_ids)
+        cursor = self._connection().cursor()
+        fee_cursor = self._connection().cursor()
+        cursor.execute(f"SELECT * FROM finance_records {where} ORDER BY id DESC", params)
+        
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
             
-            return records
+            records = [FinanceRecord.from_row(row) for row in rows]
+            records_by_id = {record.id: record for record in records}
+            fee_where, fee_params = _record_filter(records_by_id, column="record_id")
+            fee_cursor.execute(f"SELECT * FROM finance_fees {fee_where} ORDER BY record_id, id", fee_params)
+            for fee in fee_cursor.fetchall():
+                records_by_id[fee["record_id"]].fees.append(Fee.from_row(fee))
             
-        finally:
-            conn.close()
+            yield records
+    
+    def iter_records(self, record_ids=None, batch_size=1000):
+        """逐条读取记录（含费用项），内部按batch_size分批从数据库读取"""
+        for records in self.iter_record_batches(record_ids, batch_size):
+            yield from records
+    
+    def iter_ledger_rows(self, record_ids=None, batch_size=1000):
+        """
+        明细台账的行：记录与费用项连接查询，每个费用项一行，没有费用项的记录一行（费用列为None）
+        
+        按记录ID倒序、费用ID顺序，逐批从游标取出，不构建FinanceRecord对象
+        """
+        where, params = _record_filter(record_ids, "r.id")
+        cursor = self._connection().cursor()
+        cursor.execute(f'''
+        SELECT r.id, r.company_name, r.customer_type, r.company_nature, r.loan_amount,
+               r.loan_term, r.repayment_method, r.guarantee_type, r.loan_type,
+               r.application_method, r.loan_channel, r.start_date, r.end_date,
+               r.interest_rate, r.is_subsidized, r.total_cost,
+               f.id AS fee_id, f.name AS fee_name, f.amount AS fee_amount,
+               f.frequency AS fee_frequency, f.is_bank_bearing AS fee_is_bank_bearing
+        FROM finance_records r LEFT JOIN finance_fees f ON f.record_id = r.id
+        {where}
+        ORDER BY r.id DESC, f.id
+        ''', params)
+        
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
     
     def get_fees(self, record_id):
         """获取指定记录的费用项"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self._connection().cursor()
         
-        try:
+        cursor.execute('''
+        SELECT * FROM finance_fees WHERE record_id = ?
+        ''', (record_id,))
+        
+        fees = [Fee.from_row(fee) for fee in cursor.fetchall()]
+        return fees
+    
+    def get_summary_data(self, record_ids=None):
+        """
+        汇总表统计：按分类统计家数、笔数、贷款金额、平均利率及平均综合融资成本
+        
+        record_ids: 只统计这些记录，为None时统计全部记录（直接读取由触发器维护的汇总表）
+        返回: {分类: {'company_count', 'loan_count', 'total_amount', 'avg_rate', 'avg_cost'}}，
+            只包含有记录的分类
+        """
+        cursor = self._connection().cursor()
+        
+        if record_ids is None:
             cursor.execute('''
-            SELECT * FROM finance_fees WHERE record_id = ?
-            ''', (record_id,))
-            
-            fees = [dict(fee) for fee in cursor.fetchall()]
-            return fees
-            
-        finally:
-            conn.close() 
\ No newline at end of file
+            SELECT category, company_count, loan_count, amount_sum,
+                   rate_sum / loan_count, cost_sum / loan_count
+            FROM summary_category_totals WHERE loan_count > 0
+            ''')
+            return self._summary_rows(cursor.fetchall())
+        
+        # 选中的部分记录：一次扫描，每条记录按分类规则展开为其所属的各分类后分组统计
+        company = _summary_company_name_sql("scope.")
+        categories = _summary_categories_sql(
+            "scope.", has_fees=f"{company} IN (SELECT company_name FROM fee_companies)"
+        )
+        
+        where, params = _record_filter(record_ids)
+        cursor.execute(f'''
+        WITH scope AS (
+            SELECT * FROM finance_records {where}
+        ),
+        -- 有非银行承担费用的企业，其全部贷款计入"有利息外费用的企业贷款"
+        fee_companies AS (
+            SELECT DISTINCT {company} AS company_name FROM scope
+            JOIN finance_fees ON finance_fees.record_id = scope.id
+            WHERE COALESCE(finance_fees.is_bank_bearing, 0) = 0
+        )
+        SELECT category.value, COUNT(DISTINCT {company}), COUNT(*),
+               SUM(scope.loan_amount), AVG(scope.interest_rate), AVG(scope.total_cost)
+        FROM scope, {categories} AS category
+        WHERE category.value IS NOT NULL GROUP BY category.value
+        ''', params)
+        return self._summary_rows(cursor.fetchall())
+    
+    def _summary_rows(self, rows):
+        """将(分类, 家数, 笔数, 贷款金额, 平均利率, 平均综合融资成本)行整理为汇总数据字典"""
+        summary_data = {}
+        for category, company_count, loan_count, total_amount, avg_rate, avg_cost in rows:
+            summary_data[category] = {
+                'company_count': company_count,
+                'loan_count': loan_count,
+                'total_amount': total_amount,
+                'avg_rate': avg_rate or 0,
+                'avg_cost': avg_cost or 0
+            }
+        
+        return summary_data
+
+
+def _record_filter(record_ids, column="id"):
+    """按记录ID筛选的WHERE子句及参数；ID以一个JSON数组参数传入，不受SQLite参数个数限制"""
+    if record_ids is None:
+        return "", []
+    return (f"WHERE {column} IN (SELECT value FROM json_each(?))",
+            [json.dumps([int(record_id) for record_id in record_ids])])
+
+
+def _migrate_base_tables(cursor):
+    """迁移1：创建记录表和费用表；旧版程序创建的表补齐缺失的列并为已有记录生成UUID"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row[0] for row in cursor.fetchall()}
+    
+    if "finance_records" not in tables:
+        cursor.execute('''
+        CREATE TABLE finance_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT UNIQUE,
+            company_name TEXT,
+            loan_amount REAL,
+            repayment_method TEXT,
+            loan_term INTEGER,
+            interest_frequency TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            first_payment_date TEXT,
+            interest_rate REAL,
+            total_cost REAL,
+            loan_channel TEXT,
+            customer_type TEXT,
+            company_nature TEXT,
+            guarantee_type TEXT,
+            loan_type TEXT,
+            application_method TEXT,
+            is_subsidized INTEGER,
+            create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+    else:
+        cursor.execute("PRAGMA table_info(finance_records)")
+        columns = {row[1] for row in cursor.fetchall()}
+        
+        # 需要添加的新列（ALTER TABLE不能添加UNIQUE列，uuid的唯一性由下面的唯一索引保证）
+        new_columns = {
+            "uuid": "TEXT",
+            "loan_channel": "TEXT",
+            "customer_type": "TEXT",
+            "company_nature": "TEXT",
+            "guarantee_type": "TEXT",
+            "loan_type": "TEXT",
+            "application_method": "TEXT",
+            "is_subsidized": "INTEGER"
+        }
+        for col_name, col_type in new_columns.items():
+            if col_name not in columns:
+                cursor.execute(f"ALTER TABLE finance_records ADD COLUMN {col_name} {col_type}")
+        
+        # 为没有UUID的记录批量生成UUID
+        cursor.execute("SELECT id FROM finance_records WHERE uuid IS NULL OR uuid = ''")
+        cursor.executemany(
+            "UPDATE finance_records SET uuid = ? WHERE id = ?",
+            [(str(uuid.uuid4()), row[0]) for row in cursor.fetchall()]
+        )
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_finance_records_uuid ON finance_records (uuid)")
+    
+    if "finance_fees" not in tables:
+        cursor.execute('''
+        CREATE TABLE finance_fees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            record_id INTEGER,
+            name TEXT,
+            amount REAL,
+            frequency TEXT,
+            is_bank_bearing INTEGER DEFAULT 0,
+            FOREIGN KEY (record_id) REFERENCES finance_records (id) ON DELETE CASCADE
+        )
+        ''')
+    else:
+        # 为费用表添加是否银行承担字段
+        cursor.execute("PRAGMA table_info(finance_fees)")
+        if "is_bank_bearing" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE finance_fees ADD COLUMN is_bank_bearing INTEGER DEFAULT 0")
+
+
+def _migrate_result_cache(cursor):
+    """迁移2：计算结果缓存表，按输入指纹保存综合融资成本及各费用年化率"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS finance_result_cache (
+        fingerprint TEXT PRIMARY KEY,
+        calculator_version TEXT,
+        total_cost REAL,
+        fee_annual_rates TEXT,
+        create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def _migrate_indexes(cursor):
+    """迁移3：索引，费用按记录查询、记录按企业名称/创建时间及分类字段筛选"""
+    indexes = {
+        "idx_finance_fees_record_id": "finance_fees (record_id)",
+        "idx_finance_records_company_name": "finance_records (company_name)",
+        "idx_finance_records_create_time": "finance_records (create_time)",
+        "idx_finance_records_customer_type": "finance_records (customer_type)",
+        "idx_finance_records_company_nature": "finance_records (company_nature)",
+        "idx_finance_records_guarantee_type": "finance_records (guarantee_type)",
+        "idx_finance_records_loan_type": "finance_records (loan_type)",
+        "idx_finance_records_application_method": "finance_records (application_method)",
+        "idx_finance_records_is_subsidized": "finance_records (is_subsidized)"
+    }
+    for index_name, definition in indexes.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {definition}")
+
+
+def _sql_literal(value):
+    """分类规则中的取值转为SQL字面量"""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+
+def _summary_case_sql(axis, value_sql):
+    """一个分类维度的CASE表达式：取值为所属分类的名称，不属于该维度任何分类时为NULL"""
+    branches = " ".join(
+        f"WHEN {_sql_literal(category.value)} THEN {_sql_literal(category.label)}"
+        for category in SUMMARY_CATEGORIES if category.axis == axis
+    )
+    return f"CASE {value_sql} {branches} END"
+
+
+def _summary_axes():
+    """按记录分类的维度（记录的列名），按分类规则中首次出现的顺序"""
+    return list(dict.fromkeys(
+        category.axis for category in SUMMARY_CATEGORIES if category.axis not in (None, "has_fees")
+    ))
+
+
+def _summary_company_name_sql(row):
+    """汇总表中的企业名称：未填企业名称（NULL）的记录与空名称归为同一企业"""
+    return f"COALESCE({row}company_name, '')"
+
+
+def _summary_categories_sql(row, has_fees=None):
+    """
+    由分类规则生成表值函数json_each(...)，每行的value为记录所属的一个分类（不属于时为NULL）
+    
+    row: 列名前缀，如触发器中的"NEW."/"OLD."
+    has_fees: 企业是否有利息外费用的SQL条件，为None时不包含按企业分类的维度
+    """
+    expressions = [_sql_literal(category.label) for category in SUMMARY_CATEGORIES if category.axis is None]
+    if has_fees is not None:
+        expressions.append(_summary_case_sql("has_fees", f"({has_fees})"))
+    expressions += [_summary_case_sql(axis, f"{row}{axis}") for axis in _summary_axes()]
+    return f"json_each(json_array({', '.join(expressions)}))"
+
+
+def _summary_record_sql(row, sign):
+    """
+    触发器语句：将一条记录（row为"NEW."/"OLD."）计入（sign为1）或移出（sign为-1）汇总表
+    
+    summary_category_totals: 各分类的家数、笔数及金额、利率、综合融资成本之和
+    summary_category_companies: 各分类包含的企业及其笔数，用于维护家数
+    summary_company_totals: 各企业的合计及非银行承担费用数，用于维护有/无利息外费用分类
+    """
+    categories = f"SELECT value AS category FROM {_summary_categories_sql(row)} WHERE value IS NOT NULL"
+    values = (f"COALESCE({row}loan_amount, 0), COALESCE({row}interest_rate, 0), "
+              f"COALESCE({row}total_cost, 0)")
+    customer_fees = (f"(SELECT COUNT(*) FROM finance_fees WHERE record_id = {row}id "
+                     f"AND COALESCE(is_bank_bearing, 0) = 0)")
+    company = _summary_company_name_sql(row)
+    
+    if sign > 0:
+        # 先建分类合计行，再登记企业（登记新企业时由触发器增加家数）
+        return f'''
+        INSERT INTO summary_category_totals
+            (category, company_count, loan_count, amount_sum, rate_sum, cost_sum)
+        SELECT category, 0, 1, {values} FROM ({categories}) WHERE true
+        ON CONFLICT(category) DO UPDATE SET
+            loan_count = loan_count + 1, amount_sum = amount_sum + excluded.amount_sum,
+            rate_sum = rate_sum + excluded.rate_sum, cost_sum = cost_sum + excluded.cost_sum;
+        INSERT INTO summary_category_companies (category, company_name, loan_count)
+        SELECT category, {company}, 1 FROM ({categories}) WHERE true
+        ON CONFLICT(category, company_name) DO UPDATE SET loan_count = loan_count + 1;
+        INSERT INTO summary_company_totals
+            (company_name, loan_count, amount_sum, rate_sum, cost_sum, customer_fee_count)
+        VALUES ({company}, 1, {values}, {customer_fees})
+        ON CONFLICT(company_name) DO UPDATE SET
+            loan_count = loan_count + 1, amount_sum = amount_sum + excluded.amount_sum,
+            rate_sum = rate_sum + excluded.rate_sum, cost_sum = cost_sum + excluded.cost_sum,
+            customer_fee_count = customer_fee_count + excluded.customer_fee_count;
+        '''
+    
+    # 先注销企业（笔数为0时删除，由触发器减少家数），再更新分类合计，笔数为0的分类删除
+    return f'''
+    UPDATE summary_category_companies SET loan_count = loan_count - 1
+    WHERE company_name = {company} AND category IN ({categories});
+    DELETE FROM summary_category_companies
+    WHERE company_name = {company} AND loan_count <= 0;
+    UPDATE summary_category_totals SET
+        loan_count = loan_count - 1, amount_sum = amount_sum - COALESCE({row}loan_amount, 0),
+        rate_sum = rate_sum - COALESCE({row}interest_rate, 0),
+        cost_sum = cost_sum - COALESCE({row}total_cost, 0)
+    WHERE category IN ({categories});
+    DELETE FROM summary_category_totals WHERE loan_count <= 0;
+    UPDATE summary_company_totals SET
+        loan_count = loan_count - 1, amount_sum = amount_sum - COALESCE({row}loan_amount, 0),
+        rate_sum = rate_sum - COALESCE({row}interest_rate, 0),
+        cost_sum = cost_sum - COALESCE({row}total_cost, 0),
+        customer_fee_count = customer_fee_count - {customer_fees}
+    WHERE company_name = {company};
+    DELETE FROM summary_company_totals
+    WHERE company_name = {company} AND loan_count <= 0;
+    '''
+
+
+def _summary_values_sql():
+    """触发器语句：记录的分类不变，只有金额、利率、综合融资成本变化时，只更新各合计"""
+    categories = _summary_categories_sql("NEW.")
+    deltas = '''
+        amount_sum = amount_sum + COALESCE(NEW.loan_amount, 0) - COALESCE(OLD.loan_amount, 0),
+        rate_sum = rate_sum + COALESCE(NEW.interest_rate, 0) - COALESCE(OLD.interest_rate, 0),
+        cost_sum = cost_sum + COALESCE(NEW.total_cost, 0) - COALESCE(OLD.total_cost, 0)
+    '''
+    return f'''
+    UPDATE summary_category_totals SET {deltas}
+    WHERE category IN (SELECT value FROM {categories});
+    UPDATE summary_company_totals SET {deltas}
+    WHERE company_name = {_summary_company_name_sql("NEW.")};
+    '''
+
+
+def _summary_company_sql(row, sign):
+    """触发器语句：将一个企业的合计（row为"NEW."/"OLD."）计入或移出有/无利息外费用分类"""
+    category = _summary_case_sql("has_fees", f"({row}customer_fee_count > 0)")
+    if sign > 0:
+        return f'''
+        INSERT INTO summary_category_totals
+            (category, company_count, loan_count, amount_sum, rate_sum, cost_sum)
+        VALUES ({category}, {row}loan_count > 0, {row}loan_count,
+                {row}amount_sum, {row}rate_sum, {row}cost_sum)
+        ON CONFLICT(category) DO UPDATE SET
+            company_count = company_count + excluded.company_count,
+            loan_count = loan_count + excluded.loan_count, amount_sum = amount_sum + excluded.amount_sum,
+            rate_sum = rate_sum + excluded.rate_sum, cost_sum = cost_sum + excluded.cost_sum;
+        '''
+    return f'''
+    UPDATE summary_category_totals SET
+        company_count = company_count - ({row}loan_count > 0),
+        loan_count = loan_count - {row}loan_count, amount_sum = amount_sum - {row}amount_sum,
+        rate_sum = rate_sum - {row}rate_sum, cost_sum = cost_sum - {row}cost_sum
+    WHERE category = {category};
+    DELETE FROM summary_category_totals WHERE loan_count <= 0;
+    '''
+
+
+def _summary_fee_sql(row, sign):
+    """触发器语句：非银行承担的费用（row为"NEW."/"OLD."）计入或移出所属企业的费用数"""
+    # 级联删除费用时所属记录已删除，查不到企业，此时已由记录的删除触发器一并扣减
+    company = _summary_company_name_sql("")
+    return f'''
+    UPDATE summary_company_totals
+    SET customer_fee_count = customer_fee_count + {sign} * (COALESCE({row}is_bank_bearing, 0) = 0)
+    WHERE company_name = (SELECT {company} FROM finance_records WHERE id = {row}record_id);
+    '''
+
+
+def _summary_triggers():
+    """由分类规则生成维护汇总表的触发器 {触发器名: (触发时机, 语句)}"""
+    # 决定记录所属分类的列有变化时移出再重新计入，只有金额、利率、综合融资成本变化时（如重新计算）只更新合计
+    category_columns = ["company_name"] + _summary_axes()
+    value_columns = "loan_amount, interest_rate, total_cost"
+    category_changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in category_columns)
+    triggers = {
+        "summary_records_insert": ("AFTER INSERT ON finance_records", _summary_record_sql("NEW.", 1)),
+        # 删除前统计，此时记录的费用尚未被级联删除
+        "summary_records_delete": ("BEFORE DELETE ON finance_records", _summary_record_sql("OLD.", -1)),
+        "summary_records_update": (
+            f"AFTER UPDATE OF {', '.join(category_columns)}, {value_columns} ON finance_records "
+            f"WHEN {category_changed}",
+            _summary_record_sql("OLD.", -1) + _summary_record_sql("NEW.", 1)),
+        "summary_records_update_values": (
+            f"AFTER UPDATE OF {value_columns} ON finance_records WHEN NOT ({category_changed})",
+            _summary_values_sql()),
+        "summary_companies_insert": ("AFTER INSERT ON summary_company_totals",
+                                     _summary_company_sql("NEW.", 1)),
+        "summary_companies_delete": ("AFTER DELETE ON summary_company_totals",
+                                     _summary_company_sql("OLD.", -1)),
+        "summary_companies_update": ("AFTER UPDATE ON summary_company_totals",
+                                     _summary_company_sql("OLD.", -1) + _summary_company_sql("NEW.", 1)),
+        "summary_category_companies_insert": (
+            "AFTER INSERT ON summary_category_companies",
+            "UPDATE summary_category_totals SET company_count = company_count + 1 "
+            "WHERE category = NEW.category;"),
+        "summary_category_companies_delete": (
+            "AFTER DELETE ON summary_category_companies",
+            "UPDATE summary_category_totals SET company_count = company_count - 1 "
+            "WHERE category = OLD.category;"),
+        "summary_fees_insert": ("AFTER INSERT ON finance_fees", _summary_fee_sql("NEW.", 1)),
+        "summary_fees_delete": ("AFTER DELETE ON finance_fees", _summary_fee_sql("OLD.", -1)),
+        "summary_fees_update": ("AFTER UPDATE OF record_id, is_bank_bearing ON finance_fees",
+                                _summary_fee_sql("OLD.", -1) + _summary_fee_sql("NEW.", 1)),
+    }
+    return triggers
+
+
+def _summary_signature():
+    """分类规则及触发器的签名，与数据库中保存的不一致时需重建汇总表"""
+    return hashlib.sha1(json.dumps(_summary_triggers(), ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _rebuild_summary_aggregates(cursor):
+    """按当前的分类规则重建汇总表的触发器，并由现有记录重新计算汇总数据"""
+    for trigger_name, (event, body) in _summary_triggers().items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+        cursor.execute(f"CREATE TRIGGER {trigger_name} {event} BEGIN {body} END")
+    
+    cursor.execute("DELETE FROM summary_category_companies")
+    cursor.execute("DELETE FROM summary_company_totals")
+    cursor.execute("DELETE FROM summary_category_totals")
+    
+    # 按记录分类的合计，再登记各分类的企业（由触发器计入家数）
+    categories = _summary_categories_sql("finance_records.")
+    cursor.execute(f'''
+    INSERT INTO summary_category_totals
+        (category, company_count, loan_count, amount_sum, rate_sum, cost_sum)
+    SELECT category.value, 0, COUNT(*), TOTAL(loan_amount), TOTAL(interest_rate), TOTAL(total_cost)
+    FROM finance_records, {categories} AS category
+    WHERE category.value IS NOT NULL GROUP BY category.value
+    ''')
+    company = _summary_company_name_sql("finance_records.")
+    cursor.execute(f'''
+    INSERT INTO summary_category_companies (category, company_name, loan_count)
+    SELECT category.value, {company}, COUNT(*)
+    FROM finance_records, {categories} AS category
+    WHERE category.value IS NOT NULL GROUP BY category.value, {company}
+    ''')
+    
+    # 各企业的合计（由触发器计入有/无利息外费用分类）
+    cursor.execute(f'''
+    INSERT INTO summary_company_totals
+        (company_name, loan_count, amount_sum, rate_sum, cost_sum, customer_fee_count)
+    SELECT {company}, COUNT(*), TOTAL(loan_amount), TOTAL(interest_rate), TOTAL(total_cost),
+           SUM((SELECT COUNT(*) FROM finance_fees
+                  WHERE record_id = finance_records.id AND COALESCE(is_bank_bearing, 0) = 0))
+    FROM finance_records GROUP BY {company}
+    ''')
+
+
+def _migrate_summary_aggregates(cursor):
+    """迁移4：汇总表的分类合计，由触发器随记录和费用的增删改维护，导出汇总表时无需统计全部记录"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS summary_category_totals (
+        category TEXT PRIMARY KEY,
+        company_count INTEGER,
+        loan_count INTEGER,
+        amount_sum REAL,
+        rate_sum REAL,
+        cost_sum REAL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS summary_category_companies (
+        category TEXT,
+        company_name TEXT,
+        loan_count INTEGER,
+        PRIMARY KEY (category, company_name)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS summary_company_totals (
+        company_name TEXT PRIMARY KEY,
+        loan_count INTEGER,
+        amount_sum REAL,
+        rate_sum REAL,
+        cost_sum REAL,
+        customer_fee_count INTEGER
+    )
+    ''')
+    # 触发器及汇总数据按当前的分类规则生成，由init_database的签名检查在全部迁移之后统一重建一次
+
+
+def _migrate_summary_settings(cursor):
+    """迁移5：保存汇总表分类规则签名的设置表，分类规则变化后启动时自动重建汇总表"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS summary_settings (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
+
+
+# 按顺序执行的数据库迁移，第n个迁移执行后user_version为n；只能在末尾追加，不能修改已发布的迁移
+_MIGRATIONS = [
+    _migrate_base_tables,
+    _migrate_result_cache,
+    _migrate_indexes,
+    _migrate_summary_aggregates,
+    _migrate_summary_settings,
+]
@@ -3,13 +3,17 @@ import sys
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import pandas as pd
+import numpy as np
 import datetime as dt
 from dateutil.relativedelta import relativedelta  # 导入relativedelta用于月份计算
-from calculator import FinanceCostCalculator
+from calculator import FinanceCostCalculator, ParallelCostCalculator, CALCULATOR_VERSION
 from database import RecordManager
+from models import Fee, FinanceRecord, SUMMARY_CATEGORIES, parse_fees, format_fees
 from datetime import datetime
 import xlsxwriter  # 添加xlsxwriter导入
+from openpyxl import load_workbook
 import uuid  # 添加uuid导入用于生成唯一标识
+import multiprocessing
 
 class DateEntry(ttk.Frame):
     """自定义日期输入组件，替代tkcalendar的DateEntry"""
@@ -55,6 +59,12 @@ class DateEntry(ttk.Frame):
             self.date_var.set(date)
 
 class FinanceCostApp:
+    # 导入时每批解析、计算并保存的行数
+    IMPORT_BATCH_SIZE = 5000
+    # 导出时每批从数据库读取并计算的记录数；需大于ParallelCostCalculator的loans_per_task，
+    # 否则每批都在当前进程内计算，不会分发到进程池
+    EXPORT_BATCH_SIZE = 10000
+    
     def __init__(self, root):
         check_date()
         self.root = root
@@ -63,7 +73,12 @@ class FinanceCostApp:
         
         # 使用自动模式，根据首次还款日智能选择计算方法
         self.calculator = FinanceCostCalculator(calculation_mode="auto")
+        # 批量计算（导入、导出、重新计算全部记录）使用多进程
+        self.parallel_calculator = ParallelCostCalculator(self.calculator)
+        self.last_batch_errors = {}  # 最近一次批量计算失败的记录（记录下标 -> 错误信息）
         self.record_manager = RecordManager("finance_records.db")
+        # 旧版本计算器的结果不会再被读取，启动时清除
+        self.record_manager.clear_cached_results(keep_version=CALCULATOR_VERSION)
         
         self.fees = []  # 存储费用项
         self.current_record_id = None  # 当前选中的记录ID
@@ -134,6 +149,9 @@ class FinanceCostApp:
         # 删除记录按钮
         ttk.Button(button_row1, text="删除选中记录", command=self.delete_record).pack(side=tk.LEFT, padx=5)
         
+        # 重新计算全部记录按钮
+        ttk.Button(button_row1, text="重新计算全部记录", command=self.recalculate_all_records).pack(side=tk.LEFT, padx=5)
+        
         # 第二行按钮 - 导入导出功能
         button_row2 = ttk.Frame(button_frame)
         button_row2.pack(fill=tk.X, pady=5)
@@ -504,12 +522,7 @@ class FinanceCostApp:
         self.fee_tree.insert("", tk.END, values=(name, amount, frequency, "是" if is_bank_bearing else "否"))
         
         # 添加到费用列表
-        self.fees.append({
-            "name": name, 
-            "amount": amount, 
-            "frequency": frequency,
-            "is_bank_bearing": is_bank_bearing
-        })
+        self.fees.append(Fee(name, amount, frequency, is_bank_bearing))
         
         # 清空输入框
         self.fee_name.delete(0, tk.END)
@@ -625,12 +638,13 @@ class FinanceCostApp:
             is_subsidized = 1 if self.is_subsidized.get() == "是" else 0 if hasattr(self, "is_subsidized") else 0
             
             # 保存记录
-            fees_data = [{"name": fee["name"], "amount": fee["amount"], "frequency": fee["frequency"], 
-                         "is_bank_bearing": fee.get("is_bank_bearing", 0)} 
-                        for fee in self.fees]
+            fees_data = list(self.fees)
             
             if self.current_record_id:
-                # 更新记录
+                # 更新记录，并清除修改前输入的结果缓存
+                old_record = self.record_manager.get_record(self.current_record_id)
+                if old_record:
+                    self._discard_cached_results([old_record])
                 self.record_manager.update_record(
                     self.current_record_id, company_name, loan_amount, repayment_method, loan_term,
                     interest_frequency, start_date, end_date, first_payment_date,
@@ -678,6 +692,40 @@ class FinanceCostApp:
             # 删除后清空表单
             self.new_record()
     
+    def recalculate_all_records(self):
+        """按当前计算规则重新计算全部记录的综合融资成本"""
+        check_date()
+        if not messagebox.askyesno("确认", "确定要重新计算全部记录的综合融资成本吗?"):
+            return
+        
+        try:
+            records = self.record_manager.get_all_records()
+            if not records:
+                messagebox.showinfo("提示", "没有可计算的记录")
+                return
+            
+            total_costs = self._calculate_records_total_cost(records)
+            errors = self.last_batch_errors
+            
+            # 计算失败的记录保留原值
+            self.record_manager.update_total_costs([
+                (record.id, total_cost)
+                for i, (record, total_cost) in enumerate(zip(records, total_costs))
+                if i not in errors
+            ])
+            self.load_records()
+            
+            msg = f"已重新计算 {len(records) - len(errors)} 条记录"
+            if errors:
+                failed = [f"ID {records[i].id}: {message}" for i, message in errors.items()]
+                msg += f"\n\n以下记录计算失败:\n" + "\n".join(failed[:5])
+                if len(failed) > 5:
+                    msg += f"\n...还有{len(failed)-5}条记录失败"
+            messagebox.showinfo("完成", msg)
+        
+        except Exception as e:
+            messagebox.showerror("错误", f"重新计算记录时发生错误: {str(e)}")
+    
     def export_records(self):
         check_date()
         try:
@@ -689,135 +737,221 @@ class FinanceCostApp:
             if not file_path:
                 return
             
-            # 获取记录数据
-            records = self.record_manager.get_all_records()
-            
-            # 创建DataFrame
-            if not records:
+            if self.record_manager.count_records() == 0:
                 messagebox.showinfo("提示", "没有记录可以导出")
                 return
-                
-            # 准备数据
-            export_data = []
-            for record in records:
-                # 使用IRR方法计算费用年化率
-                fees_annual_rates = {}
-                fees_period_rates = {}
-                if record.get("fees"):
-                    loan_amount = float(record["loan_amount"]) * 10000  # 转换为元
-                    loan_term = int(record["loan_term"])
-                    repayment_method = record["repayment_method"]
-                    
-                    for fee in record["fees"]:
-                        # 如果费用由银行承担，年化率为0
-                        if fee.get("is_bank_bearing", 0) == 1:
-                            fee_annual_rate = 0
-                            period_rate = 0
-                        else:
-                            # 计算该费用的年化利率
-                            fee_annual_rate = self.calculator.calculate_fee_annual_rate_irr(
-                                fee["amount"], 
-                                fee["frequency"], 
-                                loan_amount, 
-                                loan_term, 
-                                repayment_method,
-                                dt.datetime.strptime(record["start_date"], '%Y-%m-%d').date(),
-                                dt.datetime.strptime(record["first_payment_date"], '%Y-%m-%d').date(),
-                                record["interest_frequency"]
-                            )
-                            
-                            # 计算周期费率
-                            period_rate = fee_annual_rate * loan_term / 12
-                        
-                        fees_annual_rates[fee["name"]] = fee_annual_rate * 100  # 转为百分比
-                        fees_period_rates[fee["name"]] = period_rate * 100  # 转为百分比
-                
-                # 基本记录信息
-                record_data = {
-                    "ID": record["id"],
-                    "企业名称": record["company_name"],
-                    "贷款本金(万元)": record["loan_amount"],
-                    "还款方式": record["repayment_method"],
-                    "贷款期限(月)": record["loan_term"],
-                    "付息频率": record["interest_frequency"],
-                    "贷款起始日": record["start_date"],
-                    "贷款到期日": record["end_date"],
-                    "首次还款日": record["first_payment_date"],
-                    "贷款年化率(%)": record["interest_rate"],
-                    "综合融资成本(%)": f"{record['total_cost']:.4f}",
-                    "获取贷款渠道": record.get("loan_channel", ""),
-                    "客户类型": record.get("customer_type", ""),
-                    "企业性质": record.get("company_nature", ""),
-                    "担保方式": record.get("guarantee_type", ""),
-                    "贷款方式": record.get("loan_type", ""),
-                    "申请方式": record.get("application_method", ""),
-                    "是否财政贴息": "是" if record.get("is_subsidized", 0) == 1 else "否"
-                }
-                
-                # 费用详细信息
-                fee_detail = []
-                fee_rates = []
-                fee_period_rates = []
-                fee_bank_bearing = []
-                
-                for fee in record.get("fees", []):
-                    # 基本费用信息
-                    fee_str = f"{fee['name']}:{fee['amount']}元({fee['frequency']})"
-                    if fee.get("is_bank_bearing", 0) == 1:
-                        fee_str += "[银行承担]"
-                    fee_detail.append(fee_str)
-                    
-                    # 费用年化率信息
-                    annual_rate = fees_annual_rates.get(fee['name'], 0)
-                    period_rate = fees_period_rates.get(fee['name'], 0)
-                    
-                    fee_rates.append(f"{fee['name']}:{annual_rate:.4f}%")
-                    fee_period_rates.append(f"{fee['name']}:{period_rate:.4f}%")
-                    fee_bank_bearing.append("是" if fee.get("is_bank_bearing", 0) == 1 else "否")
-                
-                record_data["费用项"] = "; ".join(fee_detail) if fee_detail else ""
-                record_data["费用年化率"] = "; ".join(fee_rates) if fee_rates else ""
-                record_data["费用周期率"] = "; ".join(fee_period_rates) if fee_period_rates else ""
-                record_data["银行承担"] = "; ".join(fee_bank_bearing) if fee_bank_bearing else ""
-                record_data["创建时间"] = record.get("create_time", "")
-                
-                export_data.append(record_data)
-            
-            # 创建DataFrame
-            df = pd.DataFrame(export_data)
             
             # 定义列顺序
             column_order = [
-                "ID", "企业名称", "贷款本金(万元)", "还款方式", "贷款期限(月)",
+                "ID", "UUID", "企业名称", "贷款本金(万元)", "还款方式", "贷款期限(月)",
                 "付息频率", "贷款起始日", "贷款到期日", "首次还款日",
                 "贷款年化率(%)", "综合融资成本(%)", "获取贷款渠道", "客户类型",
                 "企业性质", "担保方式", "贷款方式", "申请方式", "是否财政贴息",
                 "费用项", "费用年化率", "费用周期率", "银行承担", "创建时间"
             ]
             
-            # 只保留存在的列并按顺序排列
-            existing_columns = [col for col in column_order if col in df.columns]
-            df = df[existing_columns]
+            # 费用分列放在最后：费用1名称、费用1金额(元)、费用1支付频率、费用1银行承担、费用2名称…
+            max_fees = self.record_manager.max_fee_count()
+            for k in range(1, max_fees + 1):
+                column_order += [f"费用{k}名称", f"费用{k}金额(元)", f"费用{k}支付频率", f"费用{k}银行承担"]
+            
+            # constant_memory: 逐行写入临时文件，工作表不驻留内存
+            workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
+            worksheet = workbook.add_worksheet('融资成本记录')
+            header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+            worksheet.write_row(0, 0, column_order, header_format)
+            column_widths = [len(col) for col in column_order]
+            
+            # 分批读取记录、计算费用年化率并写入，内存占用与记录总数无关
+            row = 1
+            for records in self.record_manager.iter_record_batches(batch_size=self.EXPORT_BATCH_SIZE):
+                records_fee_rates = self._calculate_records_fee_rates(records)
+                for record, fee_rates_list in zip(records, records_fee_rates):
+                    record_data = self._record_export_row(record, fee_rates_list)
+                    values = [record_data.get(col) for col in column_order]
+                    worksheet.write_row(row, 0, values)
+                    row += 1
+                    
+                    # 列宽取列中最长内容的长度
+                    for i, value in enumerate(values):
+                        if value is not None:
+                            column_widths[i] = max(column_widths[i], len(str(value)))
             
-            # 导出到Excel (加入自动列宽设置)
-            with pd.ExcelWriter(file_path, engine='xlsxwriter') as writer:
-                df.to_excel(writer, sheet_name='融资成本记录', index=False)
-                
-                # 获取xlsxwriter对象
-                workbook = writer.book
-                worksheet = writer.sheets['融资成本记录']
-                
-                # 设置列宽
-                for i, col in enumerate(df.columns):
-                    # 获取列中最长字符串的长度
-                    max_len = max(df[col].astype(str).apply(len).max(), len(col)) + 2
-                    worksheet.set_column(i, i, max_len)
+            # 设置列宽
+            for i, width in enumerate(column_widths):
+                worksheet.set_column(i, i, width + 2)
             
+            workbook.close()
             messagebox.showinfo("成功", f"记录已导出到 {file_path}")
             
         except Exception as e:
             messagebox.showerror("错误", f"导出记录时发生错误: {str(e)}")
     
+    def _record_export_row(self, record, fee_rates_list):
+        """导出记录的一行：列名 -> 值"""
+        # 费用名 -> 年化率/周期率（百分比）
+        fees_annual_rates = {}
+        fees_period_rates = {}
+        loan_term = int(record.loan_term)
+        for fee, fee_annual_rate in zip(record.fees, fee_rates_list):
+            # 计算周期费率（银行承担的费用年化率为0）
+            period_rate = fee_annual_rate * loan_term / 12
+            
+            fees_annual_rates[fee.name] = fee_annual_rate * 100  # 转为百分比
+            fees_period_rates[fee.name] = period_rate * 100  # 转为百分比
+        
+        # 基本记录信息
+        record_data = {
+            "ID": record.id,
+            "UUID": record.uuid,  # 重新导入时按UUID更新原记录
+            "企业名称": record.company_name,
+            "贷款本金(万元)": record.loan_amount,
+            "还款方式": record.repayment_method,
+            "贷款期限(月)": record.loan_term,
+            "付息频率": record.interest_frequency,
+            "贷款起始日": record.start_date,
+            "贷款到期日": record.end_date,
+            "首次还款日": record.first_payment_date,
+            "贷款年化率(%)": record.interest_rate,
+            "综合融资成本(%)": f"{record.total_cost:.4f}",
+            "获取贷款渠道": record.loan_channel,
+            "客户类型": record.customer_type,
+            "企业性质": record.company_nature,
+            "担保方式": record.guarantee_type,
+            "贷款方式": record.loan_type,
+            "申请方式": record.application_method,
+            "是否财政贴息": "是" if record.is_subsidized == 1 else "否"
+        }
+        
+        # 费用详细信息
+        fee_rates = []
+        fee_period_rates = []
+        fee_bank_bearing = []
+        
+        for k, fee in enumerate(record.fees, start=1):
+            # 费用分列，便于重新导入时直接读取
+            record_data[f"费用{k}名称"] = fee.name
+            record_data[f"费用{k}金额(元)"] = fee.amount
+            record_data[f"费用{k}支付频率"] = fee.frequency
+            record_data[f"费用{k}银行承担"] = "是" if fee.is_bank_bearing == 1 else "否"
+            
+            # 费用年化率信息
+            annual_rate = fees_annual_rates.get(fee.name, 0)
+            period_rate = fees_period_rates.get(fee.name, 0)
+            
+            if pd.isna(annual_rate):  # 计算失败
+                fee_rates.append(f"{fee.name}:计算失败")
+                fee_period_rates.append(f"{fee.name}:计算失败")
+            else:
+                fee_rates.append(f"{fee.name}:{annual_rate:.4f}%")
+                fee_period_rates.append(f"{fee.name}:{period_rate:.4f}%")
+            fee_bank_bearing.append("是" if fee.is_bank_bearing == 1 else "否")
+        
+        record_data["费用项"] = format_fees(record.fees)
+        record_data["费用年化率"] = "; ".join(fee_rates) if fee_rates else ""
+        record_data["费用周期率"] = "; ".join(fee_period_rates) if fee_period_rates else ""
+        record_data["银行承担"] = "; ".join(fee_bank_bearing) if fee_bank_bearing else ""
+        record_data["创建时间"] = record.create_time
+        
+        return record_data
+    
+    def _calculate_records_batch(self, records):
+        """
+        批量计算记录的综合融资成本及费用年化率（费用按记录顺序平铺）
+        
+        已计算过的输入直接读取数据库中的结果缓存，其余记录计算后写回缓存；
+        计算失败的记录结果为nan，失败原因记录在last_batch_errors中（记录下标 -> 错误信息）
+        """
+        parsed = [self._record_inputs(record) for record in records]
+        fingerprints = [
+            self.calculator.input_fingerprint(*loan, record.fees)
+            for loan, record in zip(parsed, records)
+        ]
+        results = self.record_manager.get_cached_results(fingerprints, CALCULATOR_VERSION)
+        self.last_batch_errors = {}
+        
+        # 计算缓存中没有的记录
+        missing = [i for i, fingerprint in enumerate(fingerprints) if fingerprint not in results]
+        if missing:
+            fee_loan_index = []
+            fee_amounts = []
+            fee_frequencies = []
+            fee_is_bank_bearing = []
+            for j, i in enumerate(missing):
+                for fee in records[i].fees:
+                    fee_loan_index.append(j)
+                    fee_amounts.append(fee.amount)
+                    fee_frequencies.append(fee.frequency)
+                    fee_is_bank_bearing.append(fee.is_bank_bearing)
+            
+            total_costs, fee_annual_rates = self.parallel_calculator.calculate_finance_cost_batch(
+                *[list(column) for column in zip(*[parsed[i] for i in missing])],
+                fee_loan_index, fee_amounts, fee_frequencies, fee_is_bank_bearing
+            )
+            
+            missing_fee_rates = [[] for _ in missing]
+            for j, rate in zip(fee_loan_index, fee_annual_rates):
+                missing_fee_rates[j].append(float(rate))
+            
+            new_results = []
+            for j, i in enumerate(missing):
+                if j in self.parallel_calculator.last_batch_errors:
+                    self.last_batch_errors[i] = self.parallel_calculator.last_batch_errors[j]
+                    results[fingerprints[i]] = (float("nan"), missing_fee_rates[j])
+                else:
+                    results[fingerprints[i]] = (float(total_costs[j]), missing_fee_rates[j])
+                    new_results.append((fingerprints[i],) + results[fingerprints[i]])
+            self.record_manager.save_cached_results(new_results, CALCULATOR_VERSION)
+        
+        # 按记录顺序合并
+        total_costs = []
+        fee_loan_index = []
+        fee_annual_rates = []
+        for i, fingerprint in enumerate(fingerprints):
+            total_cost, fee_rates = results[fingerprint]
+            total_costs.append(total_cost)
+            fee_loan_index.extend([i] * len(fee_rates))
+            fee_annual_rates.extend(fee_rates)
+        return total_costs, fee_loan_index, fee_annual_rates
+    
+    def _record_inputs(self, record):
+        """记录的计算输入：(贷款本金(元), 还款方式, 期限, 付息频率, 年利率(小数), 起始日, 到期日, 首次还款日)"""
+        return (
+            float(record.loan_amount) * 10000,  # 转换为元
+            record.repayment_method,
+            int(record.loan_term),
+            record.interest_frequency,
+            float(record.interest_rate) / 100,  # 转换为小数
+            dt.datetime.strptime(record.start_date, '%Y-%m-%d').date(),
+            dt.datetime.strptime(record.end_date, '%Y-%m-%d').date(),
+            dt.datetime.strptime(record.first_payment_date, '%Y-%m-%d').date()
+        )
+    
+    def _discard_cached_results(self, records):
+        """删除记录当前输入的结果缓存，在记录被修改前调用；输入无法解析的记录没有缓存，跳过"""
+        fingerprints = []
+        for record in records:
+            try:
+                fingerprints.append(self.calculator.input_fingerprint(*self._record_inputs(record), record.fees))
+            except (TypeError, ValueError):
+                continue
+        self.record_manager.delete_cached_results(fingerprints)
+    
+    def _calculate_records_total_cost(self, records):
+        """批量计算记录的综合融资成本(百分比)"""
+        total_costs, _, _ = self._calculate_records_batch(records)
+        return [float(cost) for cost in total_costs]
+    
+    def _calculate_records_fee_rates(self, records):
+        """批量计算记录中各费用的年化率，返回与每条记录费用顺序一致的列表"""
+        _, fee_loan_index, fee_annual_rates = self._calculate_records_batch(records)
+        
+        # 按记录拆分
+        records_fee_rates = [[] for _ in records]
+        for i, rate in zip(fee_loan_index, fee_annual_rates):
+            records_fee_rates[i].append(float(rate))
+        return records_fee_rates
+    
     def on_record_select(self, event):
         check_date()
         selected = self.records_tree.selection()
@@ -833,13 +967,13 @@ class FinanceCostApp:
             
             # 填充基本表单
             self.company_name.delete(0, tk.END)
-            self.company_name.insert(0, record["company_name"])
+            self.company_name.insert(0, record.company_name)
             
             self.loan_amount.delete(0, tk.END)
-            self.loan_amount.insert(0, record["loan_amount"])
+            self.loan_amount.insert(0, record.loan_amount)
             
             # 处理还款方式（可能有自定义值）
-            repayment = record["repayment_method"]
+            repayment = record.repayment_method
             if repayment in ["等额本金", "等额本息", "一次性还本"]:
                 self.repayment_method.set(repayment)
                 # 隐藏自定义输入框
@@ -855,22 +989,22 @@ class FinanceCostApp:
                     self.custom_inputs["repayment_method"].pack(side=tk.LEFT, padx=5)
             
             self.loan_term.delete(0, tk.END)
-            self.loan_term.insert(0, record["loan_term"])
+            self.loan_term.insert(0, record.loan_term)
             
-            self.interest_frequency.set(record["interest_frequency"])
+            self.interest_frequency.set(record.interest_frequency)
             
             # 设置日期
-            self.start_date.set_date(record["start_date"])
-            self.end_date.set_date(record["end_date"])
-            self.first_payment_date.set_date(record["first_payment_date"])
+            self.start_date.set_date(record.start_date)
+            self.end_date.set_date(record.end_date)
+            self.first_payment_date.set_date(record.first_payment_date)
             
             self.interest_rate.delete(0, tk.END)
-            self.interest_rate.insert(0, record["interest_rate"])
+            self.interest_rate.insert(0, record.interest_rate)
             
             # 填充附加信息 - 处理自定义值
             # 获取贷款渠道
             if hasattr(self, "loan_channel"):
-                channel = record.get("loan_channel", "")
+                channel = record.loan_channel
                 if channel in self.loan_channel_options:
                     self.loan_channel.set(channel)
                     # 隐藏自定义输入框
@@ -889,7 +1023,7 @@ class FinanceCostApp:
             
             # 客户类型（无自定义选项）
             if hasattr(self, "customer_type"):
-                ctype = record.get("customer_type", "")
+                ctype = record.customer_type
                 if ctype and ctype in self.customer_type_options:
                     self.customer_type.set(ctype)
                 else:
@@ -897,7 +1031,7 @@ class FinanceCostApp:
             
             # 企业性质（无自定义选项）
             if hasattr(self, "company_nature"):
-                nature = record.get("company_nature", "")
+                nature = record.company_nature
                 if nature and nature in self.company_nature_options:
                     self.company_nature.set(nature)
                 else:
@@ -905,7 +1039,7 @@ class FinanceCostApp:
             
             # 担保方式
             if hasattr(self, "guarantee_type"):
-                guarantee = record.get("guarantee_type", "")
+                guarantee = record.guarantee_type
                 if guarantee in self.guarantee_type_options:
                     self.guarantee_type.set(guarantee)
                     # 隐藏自定义输入框
@@ -924,7 +1058,7 @@ class FinanceCostApp:
             
             # 贷款方式
             if hasattr(self, "loan_type"):
-                loan_type = record.get("loan_type", "")
+                loan_type = record.loan_type
                 if loan_type in self.loan_type_options:
                     self.loan_type.set(loan_type)
                     # 隐藏自定义输入框
@@ -943,7 +1077,7 @@ class FinanceCostApp:
             
             # 申请方式（无自定义选项）
             if hasattr(self, "application_method"):
-                method = record.get("application_method", "")
+                method = record.application_method
                 if method and method in self.application_method_options:
                     self.application_method.set(method)
                 else:
@@ -951,7 +1085,7 @@ class FinanceCostApp:
             
             # 是否财政贴息
             if hasattr(self, "is_subsidized"):
-                self.is_subsidized.set("是" if record.get("is_subsidized", 0) == 1 else "否")
+                self.is_subsidized.set("是" if record.is_subsidized == 1 else "否")
             
             # 加载费用项
             self.fees = []
@@ -959,14 +1093,9 @@ class FinanceCostApp:
                 self.fee_tree.delete(item)
             
             for fee in self.record_manager.get_fees(record_id):
-                is_bank_bearing = fee.get("is_bank_bearing", 0)
-                self.fees.append({
-                    "name": fee["name"],
-                    "amount": fee["amount"],
-                    "frequency": fee["frequency"],
-                    "is_bank_bearing": is_bank_bearing
-                })
-                self.fee_tree.insert("", tk.END, values=(fee["name"], fee["amount"], fee["frequency"], 
+                is_bank_bearing = fee.is_bank_bearing
+                self.fees.append(fee)
+                self.fee_tree.insert("", tk.END, values=(fee.name, fee.amount, fee.frequency, 
                                                         "是" if is_bank_bearing else "否"))
     
     def load_records(self):
@@ -980,17 +1109,17 @@ class FinanceCostApp:
         
         for record in records:
             self.records_tree.insert("", tk.END, values=(
-                record["id"],
-                record["company_name"],
-                record["loan_amount"],
-                record["repayment_method"],
-                record["loan_term"],
-                record["interest_frequency"],
-                record["start_date"],
-                record["end_date"],
-                record["first_payment_date"],
-                record["interest_rate"],
-                f"{record['total_cost']:.4f}"
+                record.id,
+                record.company_name,
+                record.loan_amount,
+                record.repayment_method,
+                record.loan_term,
+                record.interest_frequency,
+                record.start_date,
+                record.end_date,
+                record.first_payment_date,
+                record.interest_rate,
+                f"{record.total_cost:.4f}"
             ))
 
     def on_combobox_change(self, event, field_name):
@@ -1029,141 +1158,253 @@ class FinanceCostApp:
             if not file_path:
                 return
             
-            # 读取Excel文件
-            df = pd.read_excel(file_path)
-            
-            # 检查必要的列是否存在
-            required_columns = ["企业名称", "贷款本金(万元)", "还款方式", "贷款期限(月)", 
-                              "付息频率", "贷款起始日", "贷款到期日", "首次还款日", 
-                              "贷款年化率(%)"]
-            
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                messagebox.showerror("错误", f"导入文件缺少必要的列: {', '.join(missing_columns)}")
+            # openpyxl只能读取.xlsx格式，旧版.xls文件需先转换
+            if os.path.splitext(file_path)[1].lower() == ".xls":
+                messagebox.showerror("错误", "不支持旧版Excel(.xls)文件，请在Excel中另存为.xlsx格式后再导入")
                 return
             
-            imported_count = 0
-            error_rows = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # 提取基本信息
-                    company_name = str(row.get("企业名称", ""))
-                    loan_amount = float(row.get("贷款本金(万元)", 0))
-                    repayment_method = str(row.get("还款方式", "等额本金"))
-                    loan_term = int(row.get("贷款期限(月)", 0))
-                    interest_frequency = str(row.get("付息频率", "月"))
-                    start_date = str(row.get("贷款起始日", ""))
-                    end_date = str(row.get("贷款到期日", ""))
-                    first_payment_date = str(row.get("首次还款日", ""))
-                    interest_rate = float(row.get("贷款年化率(%)", 0))
-                    
-                    # 提取附加信息
-                    loan_channel = str(row.get("获取贷款渠道", ""))
-                    customer_type = str(row.get("客户类型", ""))
-                    company_nature = str(row.get("企业性质", ""))
-                    guarantee_type = str(row.get("担保方式", ""))
-                    loan_type = str(row.get("贷款方式", ""))
-                    application_method = str(row.get("申请方式", ""))
-                    is_subsidized = 1 if str(row.get("是否财政贴息", "否")) == "是" else 0
-                    
-                    # 解析费用项
-                    fees_data = []
-                    fees_str = str(row.get("费用项", ""))
-                    if fees_str and fees_str != "nan":
-                        # 解析费用字符串格式: "费用名:金额元(频率)[银行承担]; ..."
-                        fee_items = fees_str.split(";")
-                        for fee_item in fee_items:
-                            fee_item = fee_item.strip()
-                            if fee_item:
-                                # 解析费用信息
-                                parts = fee_item.split(":")
-                                if len(parts) >= 2:
-                                    fee_name = parts[0].strip()
-                                    # 提取金额和频率
-                                    fee_info = parts[1]
-                                    amount_end = fee_info.find("元")
-                                    if amount_end > 0:
-                                        amount = float(fee_info[:amount_end])
-                                        # 提取频率
-                                        freq_start = fee_info.find("(")
-                                        freq_end = fee_info.find(")")
-                                        if freq_start > 0 and freq_end > freq_start:
-                                            frequency = fee_info[freq_start+1:freq_end]
-                                        else:
-                                            frequency = "期初一次性付费"
-                                        # 检查是否银行承担
-                                        is_bank_bearing = 1 if "[银行承担]" in fee_info else 0
-                                        
-                                        fees_data.append({
-                                            "name": fee_name,
-                                            "amount": amount,
-                                            "frequency": frequency,
-                                            "is_bank_bearing": is_bank_bearing
-                                        })
-                    
-                    # 计算综合融资成本
-                    total_cost = self.calculator.calculate_finance_cost(
-                        loan_amount * 10000,  # 转换为元
-                        repayment_method,
-                        loan_term,
-                        interest_frequency,
-                        interest_rate / 100,  # 转换为小数
-                        dt.datetime.strptime(start_date, '%Y-%m-%d').date(),
-                        dt.datetime.strptime(end_date, '%Y-%m-%d').date(),
-                        dt.datetime.strptime(first_payment_date, '%Y-%m-%d').date(),
-                        fees_data
-                    )[0]
-                    
-                    # 添加记录
-                    self.record_manager.add_record(
-                        company_name, loan_amount, repayment_method, loan_term,
-                        interest_frequency, start_date, end_date, first_payment_date,
-                        interest_rate, total_cost, fees_data, loan_channel, customer_type,
-                        company_nature, guarantee_type, loan_type, application_method, is_subsidized
-                    )
-                    
-                    imported_count += 1
+            # 只读模式逐行读取Excel文件，不将整个工作表载入内存
+            workbook = load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                header = [str(name).strip() if name is not None else "" for name in next(rows, ())]
+                
+                # 检查必要的列是否存在
+                required_columns = ["企业名称", "贷款本金(万元)", "还款方式", "贷款期限(月)", 
+                                  "付息频率", "贷款起始日", "贷款到期日", "首次还款日", 
+                                  "贷款年化率(%)"]
+                
+                missing_columns = [col for col in required_columns if col not in header]
+                if missing_columns:
+                    messagebox.showerror("错误", f"导入文件缺少必要的列: {', '.join(missing_columns)}")
+                    return
+                
+                counts = {"added": 0, "updated": 0, "unchanged": 0}  # 新增、更新、无变化的行数
+                rejections = []  # 未导入的行及原因
+                raw_rows = []    # (Excel行号, 列名 -> 单元格值)
+                
+                # 逐行读取，每满一批即校验、计算并保存
+                for row_number, values in enumerate(rows, start=2):
+                    # 空单元格不放入字典，取值时使用默认值
+                    row = {name: value for name, value in zip(header, values) if value is not None}
+                    if not row:
+                        continue  # 跳过空行
                     
-                except Exception as e:
-                    error_rows.append(f"第{index+2}行: {str(e)}")
+                    raw_rows.append((row_number, row))
+                    if len(raw_rows) >= self.IMPORT_BATCH_SIZE:
+                        self._import_batch(raw_rows, rejections, counts)
+                        raw_rows = []
+                
+                self._import_batch(raw_rows, rejections, counts)
+            finally:
+                workbook.close()
+            
+            # 未导入的行写入错误报告文件，供修改后重新导入
+            error_rows = [f"第{item['Excel行号']}行: {item['错误原因']}" for item in rejections[:5]]
+            rejection_file = None
+            if rejections:
+                rejection_file = self._write_rejection_file(file_path, header, rejections)
             
             # 显示导入结果
-            if imported_count > 0:
+            imported_count = counts["added"] + counts["updated"]
+            if imported_count > 0 or counts["unchanged"] > 0:
                 self.load_records()
-                msg = f"成功导入 {imported_count} 条记录"
-                if error_rows:
-                    msg += f"\n\n以下行导入失败:\n" + "\n".join(error_rows[:5])
-                    if len(error_rows) > 5:
-                        msg += f"\n...还有{len(error_rows)-5}行错误"
+                msg = f"成功导入 {imported_count} 条记录（新增 {counts['added']} 条，更新 {counts['updated']} 条）"
+                if counts["unchanged"]:
+                    msg += f"\n{counts['unchanged']} 条与已有记录相同，已跳过"
+                if rejections:
+                    msg += f"\n\n以下行导入失败:\n" + "\n".join(error_rows)
+                    if len(rejections) > 5:
+                        msg += f"\n...还有{len(rejections)-5}行错误"
+                    if rejection_file:
+                        msg += f"\n\n全部失败行及原因已保存到 {rejection_file}"
                 messagebox.showinfo("导入完成", msg)
             else:
-                messagebox.showerror("导入失败", "没有成功导入任何记录")
+                msg = "没有成功导入任何记录"
+                if rejection_file:
+                    msg += f"\n\n失败行及原因已保存到 {rejection_file}"
+                messagebox.showerror("导入失败", msg)
                 
         except Exception as e:
             messagebox.showerror("错误", f"导入文件时发生错误: {str(e)}")
     
+    def _validate_import_batch(self, raw_rows):
+        """
+        校验并解析一批导入行，日期、金额、期限、利率按列整体解析
+        
+        返回:
+            (记录列表, 错误列表)，与raw_rows逐行对应；
+            有错误的行记录为None，错误为[(字段, 原因), ...]
+        """
+        df = pd.DataFrame([row for _, row in raw_rows], dtype=object)
+        errors = [[] for _ in raw_rows]
+        
+        def column(name, default):
+            """取一列，缺失的列或单元格使用默认值"""
+            if name not in df.columns:
+                return pd.Series([default] * len(df), dtype=object)
+            return df[name].astype(object).where(df[name].notna(), default)
+        
+        def flag(invalid, name, reason):
+            for i in np.flatnonzero(invalid):
+                errors[i].append((name, reason))
+        
+        # 日期：YYYY-MM-DD格式的文本或Excel日期
+        dates = {}
+        for name in ("贷款起始日", "贷款到期日", "首次还款日"):
+            parsed = pd.to_datetime(column(name, ""), format="%Y-%m-%d", errors="coerce")
+            flag(parsed.isna(), name, "格式应为YYYY-MM-DD")
+            dates[name] = parsed.dt.strftime("%Y-%m-%d")
+        
+        # 金额、期限、利率
+        loan_amounts = pd.to_numeric(column("贷款本金(万元)", 0), errors="coerce")
+        flag(~((loan_amounts > 0) & np.isfinite(loan_amounts)), "贷款本金(万元)", "应为大于0的数字")
+        loan_terms = pd.to_numeric(column("贷款期限(月)", 0), errors="coerce")
+        flag(~((loan_terms > 0) & (loan_terms % 1 == 0)), "贷款期限(月)", "应为正整数")
+        interest_rates = pd.to_numeric(column("贷款年化率(%)", 0), errors="coerce")
+        flag(~((interest_rates >= 0) & np.isfinite(interest_rates)), "贷款年化率(%)", "应为不小于0的数字")
+        
+        # 文本字段
+        text = {
+            name: column(name, default).astype(str).tolist()
+            for name, default in (
+                ("企业名称", ""), ("还款方式", "等额本金"), ("付息频率", "月"),
+                ("获取贷款渠道", ""), ("客户类型", ""), ("企业性质", ""), ("担保方式", ""),
+                ("贷款方式", ""), ("申请方式", ""), ("是否财政贴息", "否"), ("费用项", ""),
+                ("UUID", "")
+            )
+        }
+        
+        # 费用：有分列的费用（费用1名称、费用1金额(元)…）时只读取分列，费用项文本仅供查看、不解析；
+        # 没有分列时解析费用项文本
+        fee_groups = []
+        k = 1
+        while f"费用{k}名称" in df.columns:
+            names = column(f"费用{k}名称", "").astype(str).str.strip()
+            amounts = pd.to_numeric(column(f"费用{k}金额(元)", np.nan), errors="coerce")
+            flag((names != "") & ~np.isfinite(amounts), f"费用{k}金额(元)", "应为数字")
+            fee_groups.append((
+                names.tolist(), amounts.tolist(),
+                column(f"费用{k}支付频率", "期初一次性付费").astype(str).tolist(),
+                column(f"费用{k}银行承担", "否").astype(str).isin(["是", "1"]).tolist()
+            ))
+            k += 1
+        
+        records = []
+        for i in range(len(raw_rows)):
+            if fee_groups:
+                fees_data = [
+                    Fee(names[i], amounts[i], frequencies[i], 1 if bank_bearing[i] else 0)
+                    for names, amounts, frequencies, bank_bearing in fee_groups
+                    if names[i]
+                ]
+            else:
+                try:
+                    fees_data = parse_fees(text["费用项"][i])
+                except ValueError as e:
+                    errors[i].append(("费用项", f"{e}，格式应为\"费用名:金额元(频率)\"，多项以分号分隔"))
+            
+            if errors[i]:
+                records.append(None)
+                continue
+            
+            records.append(FinanceRecord(
+                text["企业名称"][i], float(loan_amounts[i]), text["还款方式"][i],
+                int(loan_terms[i]), text["付息频率"][i], dates["贷款起始日"][i],
+                dates["贷款到期日"][i], dates["首次还款日"][i], float(interest_rates[i]),
+                fees=fees_data, loan_channel=text["获取贷款渠道"][i],
+                customer_type=text["客户类型"][i], company_nature=text["企业性质"][i],
+                guarantee_type=text["担保方式"][i], loan_type=text["贷款方式"][i],
+                application_method=text["申请方式"][i],
+                is_subsidized=1 if text["是否财政贴息"][i] == "是" else 0,
+                uuid=text["UUID"][i].strip() or None
+            ))
+        
+        return records, errors
+    
+    def _import_batch(self, raw_rows, rejections, counts):
+        """
+        校验、计算并在一个事务内保存一批导入行
+        
+        带UUID的行按UUID更新已有记录，与已有记录内容相同的行不重新计算和写入；
+        新增、更新、无变化的行数累加到counts，未通过校验或计算失败的行追加到rejections
+        """
+        if not raw_rows:
+            return
+        
+        def reject(row_number, row, row_errors):
+            rejections.append(dict(row, **{
+                "Excel行号": row_number,
+                "错误字段": "、".join(name for name, _ in row_errors if name),
+                "错误原因": "; ".join(f"{name}{reason}" if name else reason
+                                   for name, reason in row_errors)
+            }))
+        
+        records, errors = self._validate_import_batch(raw_rows)
+        for i in range(len(raw_rows)):
+            if errors[i]:
+                reject(*raw_rows[i], errors[i])
+        
+        # 按UUID查出已有记录，内容未变化的行直接跳过
+        existing = self.record_manager.get_records_by_uuid(
+            {record.uuid for record in records if record is not None and record.uuid}
+        )
+        valid = []
+        for i, record in enumerate(records):
+            if record is None:
+                continue
+            current = existing.get(record.uuid)
+            if current is not None and current.input_key() == record.input_key():
+                counts["unchanged"] += 1
+            else:
+                valid.append(i)
+        
+        # 只对新增或有变化的行计算综合融资成本
+        total_costs = self._calculate_records_total_cost([records[i] for i in valid])
+        
+        records_to_add = []
+        for j, i in enumerate(valid):
+            if j in self.last_batch_errors:
+                reject(*raw_rows[i], [("", f"计算失败: {self.last_batch_errors[j]}")])
+                continue
+            records[i].total_cost = total_costs[j]
+            records_to_add.append(records[i])
+        
+        updated_uuids = {record.uuid for record in records_to_add if record.uuid in existing}
+        self._discard_cached_results([existing[record_uuid] for record_uuid in updated_uuids])
+        self.record_manager.upsert_records_bulk(records_to_add)
+        counts["updated"] += len(updated_uuids)
+        counts["added"] += len({record.uuid for record in records_to_add}) - len(updated_uuids)
+    
+    def _write_rejection_file(self, file_path, header, rejections):
+        """将未导入的行写入导入文件同目录下的错误报告，返回文件路径，写入失败时返回None"""
+        base, _ = os.path.splitext(file_path)
+        rejection_file = f"{base}_导入失败行.xlsx"
+        columns = ["Excel行号", "错误字段", "错误原因"] + [name for name in header if name]
+        try:
+            pd.DataFrame(rejections, columns=columns).to_excel(
+                rejection_file, sheet_name="导入失败行", index=False, engine="xlsxwriter"
+            )
+        except Exception:
+            return None
+        return rejection_file
+    
     def export_mingbaizhi(self):
         """导出明白纸功能"""
         check_date()
         try:
             # 获取选中的记录
             selected = self.records_tree.selection()
+            record_ids = None
             if not selected:
                 # 如果没有选中，询问是否导出全部
                 if not messagebox.askyesno("确认", "没有选中记录，是否导出所有记录的明白纸？"):
                     return
-                records_to_export = self.record_manager.get_all_records()
             else:
                 # 导出选中的记录
-                records_to_export = []
-                for item in selected:
-                    record_id = self.records_tree.item(item, "values")[0]
-                    record = self.record_manager.get_record(record_id)
-                    if record:
-                        records_to_export.append(record)
-            
-            if not records_to_export:
+                record_ids = [self.records_tree.item(item, "values")[0] for item in selected]
+            
+            if self.record_manager.count_records(record_ids) == 0:
                 messagebox.showinfo("提示", "没有记录可以导出")
                 return
             
@@ -1172,11 +1413,13 @@ class FinanceCostApp:
             if not save_dir:
                 return
             
-            # 为每条记录生成明白纸
-            for record in records_to_export:
+            # 逐条读取记录并生成明白纸
+            exported_count = 0
+            for record in self.record_manager.iter_records(record_ids):
                 self._export_single_mingbaizhi(record, save_dir)
+                exported_count += 1
             
-            messagebox.showinfo("成功", f"已导出 {len(records_to_export)} 份明白纸到:\n{save_dir}")
+            messagebox.showinfo("成功", f"已导出 {exported_count} 份明白纸到:\n{save_dir}")
             
         except Exception as e:
             messagebox.showerror("错误", f"导出明白纸时发生错误: {str(e)}")
@@ -1198,8 +1441,8 @@ class FinanceCostApp:
             return filename
         
         # 生成文件名
-        clean_company_name = clean_filename(record['company_name'])
-        filename = f"明白纸_{clean_company_name}_{record['id']}.xlsx"
+        clean_company_name = clean_filename(record.company_name)
+        filename = f"明白纸_{clean_company_name}_{record.id}.xlsx"
         filepath = os.path.join(save_dir, filename)
         
         # 创建Excel工作簿
@@ -1276,14 +1519,14 @@ class FinanceCostApp:
         
         # 企业名称
         worksheet.write(f'A{row}', '企业名称：', label_format)
-        worksheet.merge_range(f'B{row}:D{row}', record['company_name'], value_format)
+        worksheet.merge_range(f'B{row}:D{row}', record.company_name, value_format)
         row += 1
         
         # 客户类型和企业性质
         worksheet.write(f'A{row}', '客户类型：', label_format)
-        worksheet.write(f'B{row}', record.get('customer_type', ''), value_format)
+        worksheet.write(f'B{row}', record.customer_type, value_format)
         worksheet.write(f'C{row}', '企业性质：', label_format)
-        worksheet.write(f'D{row}', record.get('company_nature', ''), value_format)
+        worksheet.write(f'D{row}', record.company_nature, value_format)
         row += 1
         
         # 二、贷款信息
@@ -1292,54 +1535,54 @@ class FinanceCostApp:
         
         # 贷款渠道
         worksheet.write(f'A{row}', '获取贷款渠道：', label_format)
-        worksheet.merge_range(f'B{row}:D{row}', record.get('loan_channel', ''), value_format)
+        worksheet.merge_range(f'B{row}:D{row}', record.loan_channel, value_format)
         row += 1
         
         # 贷款本金和期限
         worksheet.write(f'A{row}', '贷款本金：', label_format)
-        worksheet.write(f'B{row}', f"{record['loan_amount']}万元", value_format)
+        worksheet.write(f'B{row}', f"{record.loan_amount}万元", value_format)
         worksheet.write(f'C{row}', '贷款期限：', label_format)
-        worksheet.write(f'D{row}', f"{record['loan_term']}个月", value_format)
+        worksheet.write(f'D{row}', f"{record.loan_term}个月", value_format)
         row += 1
         
         # 还款方式和付息频率
         worksheet.write(f'A{row}', '还款方式：', label_format)
-        worksheet.write(f'B{row}', record['repayment_method'], value_format)
+        worksheet.write(f'B{row}', record.repayment_method, value_format)
         worksheet.write(f'C{row}', '付息频率：', label_format)
-        worksheet.write(f'D{row}', record['interest_frequency'], value_format)
+        worksheet.write(f'D{row}', record.interest_frequency, value_format)
         row += 1
         
         # 贷款起止日期
         worksheet.write(f'A{row}', '贷款起始日：', label_format)
-        worksheet.write(f'B{row}', record['start_date'], value_format)
+        worksheet.write(f'B{row}', record.start_date, value_format)
         worksheet.write(f'C{row}', '贷款到期日：', label_format)
-        worksheet.write(f'D{row}', record['end_date'], value_format)
+        worksheet.write(f'D{row}', record.end_date, value_format)
         row += 1
         
         # 利率和担保方式
         worksheet.write(f'A{row}', '贷款年化利率：', label_format)
-        worksheet.write(f'B{row}', record['interest_rate']/100, percent_format)
+        worksheet.write(f'B{row}', record.interest_rate/100, percent_format)
         worksheet.write(f'C{row}', '担保方式：', label_format)
-        worksheet.write(f'D{row}', record.get('guarantee_type', ''), value_format)
+        worksheet.write(f'D{row}', record.guarantee_type, value_format)
         row += 1
         
         # 贷款方式和申请方式
         worksheet.write(f'A{row}', '贷款方式：', label_format)
-        worksheet.write(f'B{row}', record.get('loan_type', ''), value_format)
+        worksheet.write(f'B{row}', record.loan_type, value_format)
         worksheet.write(f'C{row}', '申请方式：', label_format)
-        worksheet.write(f'D{row}', record.get('application_method', ''), value_format)
+        worksheet.write(f'D{row}', record.application_method, value_format)
         row += 1
         
         # 是否财政贴息
         worksheet.write(f'A{row}', '是否财政贴息：', label_format)
-        worksheet.merge_range(f'B{row}:D{row}', '是' if record.get('is_subsidized', 0) == 1 else '否', value_format)
+        worksheet.merge_range(f'B{row}:D{row}', '是' if record.is_subsidized == 1 else '否', value_format)
         row += 1
         
         # 三、费用信息
         worksheet.merge_range(f'A{row}:D{row}', '三、费用信息', section_header_format)
         row += 1
         
-        if record.get('fees'):
+        if record.fees:
             # 费用表头
             worksheet.write(f'A{row}', '费用名称', center_format)
             worksheet.write(f'B{row}', '费用金额(元)', center_format)
@@ -1347,11 +1590,11 @@ class FinanceCostApp:
             worksheet.write(f'D{row}', '是否银行承担', center_format)
             row += 1
             
-            for fee in record['fees']:
-                worksheet.write(f'A{row}', fee['name'], value_format)
-                worksheet.write(f'B{row}', fee['amount'], number_format)
-                worksheet.write(f'C{row}', fee['frequency'], center_format)
-                worksheet.write(f'D{row}', '是' if fee.get('is_bank_bearing', 0) == 1 else '否', center_format)
+            for fee in record.fees:
+                worksheet.write(f'A{row}', fee.name, value_format)
+                worksheet.write(f'B{row}', fee.amount, number_format)
+                worksheet.write(f'C{row}', fee.frequency, center_format)
+                worksheet.write(f'D{row}', '是' if fee.is_bank_bearing == 1 else '否', center_format)
                 row += 1
         else:
             worksheet.merge_range(f'A{row}:D{row}', '无其他费用', center_format)
@@ -1363,7 +1606,7 @@ class FinanceCostApp:
         row += 1
         
         worksheet.write(f'A{row}', '综合融资成本(年化)：', label_format)
-        worksheet.merge_range(f'B{row}:D{row}', record['total_cost']/100, percent_format)
+        worksheet.merge_range(f'B{row}:D{row}', record.total_cost/100, percent_format)
         
         # 关闭工作簿
         workbook.close()
@@ -1374,21 +1617,16 @@ class FinanceCostApp:
         try:
             # 获取选中的记录
             selected = self.records_tree.selection()
+            record_ids = None
             if not selected:
                 # 如果没有选中，询问是否导出全部
                 if not messagebox.askyesno("确认", "没有选中记录，是否导出所有记录的明细台账？"):
                     return
-                records_to_export = self.record_manager.get_all_records()
             else:
                 # 导出选中的记录
-                records_to_export = []
-                for item in selected:
-                    record_id = self.records_tree.item(item, "values")[0]
-                    record = self.record_manager.get_record(record_id)
-                    if record:
-                        records_to_export.append(record)
-            
-            if not records_to_export:
+                record_ids = [self.records_tree.item(item, "values")[0] for item in selected]
+            
+            if self.record_manager.count_records(record_ids) == 0:
                 messagebox.showinfo("提示", "没有记录可以导出")
                 return
             
@@ -1402,8 +1640,9 @@ class FinanceCostApp:
             if not file_path:
                 return
             
-            # 创建Excel工作簿
-            workbook = xlsxwriter.Workbook(file_path)
+            # 创建Excel工作簿（constant_memory: 按行顺序写入临时文件，工作表不驻留内存，
+            # 行高等行属性须在写入该行之前设置）
+            workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
             worksheet = workbook.add_worksheet("明细台账")
             
             # 设置格式
@@ -1448,6 +1687,10 @@ class FinanceCostApp:
                 'num_format': '0.00%'
             })
             
+            # 设置行高
+            worksheet.set_row(0, 30)  # 标题行
+            worksheet.set_row(2, 40)  # 表头行
+            
             # 添加标题
             worksheet.merge_range('A1:T1', '企业贷款融资成本明细台账', title_format)
             
@@ -1468,60 +1711,41 @@ class FinanceCostApp:
                 worksheet.write(2, i, header, header_format)
                 worksheet.set_column(i, i, width)
             
-            # 设置行高
-            worksheet.set_row(0, 30)  # 标题行
-            worksheet.set_row(2, 40)  # 表头行
-            
-            # 写入数据
+            # 写入数据：直接读取记录与费用的连接查询，每个费用项一行，没有费用项的记录一行
             row = 3
-            for idx, record in enumerate(records_to_export, 1):
-                # 如果有费用项，每个费用项单独一行
-                if record.get('fees'):
-                    for fee in record['fees']:
-                        worksheet.write(row, 0, idx, cell_format)
-                        worksheet.write(row, 1, record['company_name'], cell_format)
-                        worksheet.write(row, 2, record.get('customer_type', ''), cell_format)
-                        worksheet.write(row, 3, record.get('company_nature', ''), cell_format)
-                        worksheet.write(row, 4, record['loan_amount'], number_format)
-                        worksheet.write(row, 5, record['loan_term'], cell_format)
-                        worksheet.write(row, 6, record['repayment_method'], cell_format)
-                        worksheet.write(row, 7, record.get('guarantee_type', ''), cell_format)
-                        worksheet.write(row, 8, record.get('loan_type', ''), cell_format)
-                        worksheet.write(row, 9, record.get('application_method', ''), cell_format)
-                        worksheet.write(row, 10, record.get('loan_channel', ''), cell_format)
-                        worksheet.write(row, 11, record['start_date'], cell_format)
-                        worksheet.write(row, 12, record['end_date'], cell_format)
-                        worksheet.write(row, 13, record['interest_rate']/100, percent_format)  # 除以100转换为小数
-                        worksheet.write(row, 14, '是' if record.get('is_subsidized', 0) == 1 else '否', cell_format)
-                        worksheet.write(row, 15, fee['name'], cell_format)
-                        worksheet.write(row, 16, fee['amount'], number_format)
-                        worksheet.write(row, 17, fee['frequency'], cell_format)
-                        worksheet.write(row, 18, '是' if fee.get('is_bank_bearing', 0) == 1 else '否', cell_format)
-                        worksheet.write(row, 19, record['total_cost']/100, percent_format)  # 除以100转换为小数
-                        row += 1
+            idx = 0
+            record_id = None
+            for ledger_row in self.record_manager.iter_ledger_rows(record_ids):
+                if ledger_row["id"] != record_id:
+                    record_id = ledger_row["id"]
+                    idx += 1
+                
+                has_fee = ledger_row["fee_id"] is not None
+                bank_bearing = ('是' if ledger_row["fee_is_bank_bearing"] == 1 else '否') if has_fee else ''
+                worksheet.write_row(row, 0, [
+                    idx, ledger_row["company_name"], ledger_row["customer_type"],
+                    ledger_row["company_nature"]
+                ], cell_format)
+                worksheet.write(row, 4, ledger_row["loan_amount"], number_format)
+                worksheet.write_row(row, 5, [
+                    ledger_row["loan_term"], ledger_row["repayment_method"], ledger_row["guarantee_type"],
+                    ledger_row["loan_type"], ledger_row["application_method"], ledger_row["loan_channel"],
+                    ledger_row["start_date"], ledger_row["end_date"]
+                ], cell_format)
+                worksheet.write(row, 13, ledger_row["interest_rate"]/100, percent_format)  # 除以100转换为小数
+                worksheet.write_row(row, 14, [
+                    '是' if ledger_row["is_subsidized"] == 1 else '否',
+                    ledger_row["fee_name"] if has_fee else ''
+                ], cell_format)
+                if has_fee:
+                    worksheet.write(row, 16, ledger_row["fee_amount"], number_format)
                 else:
-                    # 没有费用项的记录
-                    worksheet.write(row, 0, idx, cell_format)
-                    worksheet.write(row, 1, record['company_name'], cell_format)
-                    worksheet.write(row, 2, record.get('customer_type', ''), cell_format)
-                    worksheet.write(row, 3, record.get('company_nature', ''), cell_format)
-                    worksheet.write(row, 4, record['loan_amount'], number_format)
-                    worksheet.write(row, 5, record['loan_term'], cell_format)
-                    worksheet.write(row, 6, record['repayment_method'], cell_format)
-                    worksheet.write(row, 7, record.get('guarantee_type', ''), cell_format)
-                    worksheet.write(row, 8, record.get('loan_type', ''), cell_format)
-                    worksheet.write(row, 9, record.get('application_method', ''), cell_format)
-                    worksheet.write(row, 10, record.get('loan_channel', ''), cell_format)
-                    worksheet.write(row, 11, record['start_date'], cell_format)
-                    worksheet.write(row, 12, record['end_date'], cell_format)
-                    worksheet.write(row, 13, record['interest_rate']/100, percent_format)  # 除以100转换为小数
-                    worksheet.write(row, 14, '是' if record.get('is_subsidized', 0) == 1 else '否', cell_format)
-                    worksheet.write(row, 15, '', cell_format)  # 费用项目
-                    worksheet.write(row, 16, '', cell_format)  # 费用金额
-                    worksheet.write(row, 17, '', cell_format)  # 支付频率
-                    worksheet.write(row, 18, '', cell_format)  # 是否银行承担
-                    worksheet.write(row, 19, record['total_cost']/100, percent_format)  # 除以100转换为小数
-                    row += 1
+                    worksheet.write(row, 16, '', cell_format)
+                worksheet.write_row(row, 17, [
+                    ledger_row["fee_frequency"] if has_fee else '', bank_bearing
+                ], cell_format)
+                worksheet.write(row, 19, ledger_row["total_cost"]/100, percent_format)  # 除以100转换为小数
+                row += 1
             
             workbook.close()
             messagebox.showinfo("成功", f"明细台账已导出到: {file_path}")
@@ -1533,21 +1757,16 @@ class FinanceCostApp:
         """导出汇总表功能"""
         check_date()
         try:
-            # 获取选中的记录
+            # 获取选中的记录，没有选中时使用全部记录
             selected = self.records_tree.selection()
-            if not selected:
-                # 如果没有选中，使用全部记录
-                records_to_analyze = self.record_manager.get_all_records()
-            else:
-                # 使用选中的记录
-                records_to_analyze = []
-                for item in selected:
-                    record_id = self.records_tree.item(item, "values")[0]
-                    record = self.record_manager.get_record(record_id)
-                    if record:
-                        records_to_analyze.append(record)
-            
-            if not records_to_analyze:
+            record_ids = None
+            if selected:
+                record_ids = [self.records_tree.item(item, "values")[0] for item in selected]
+            
+            # 分析数据（在数据库中按分类汇总）
+            summary_data = self.record_manager.get_summary_data(record_ids)
+            
+            if not summary_data:
                 messagebox.showinfo("提示", "没有记录可以分析")
                 return
             
@@ -1561,9 +1780,6 @@ class FinanceCostApp:
             if not file_path:
                 return
             
-            # 分析数据
-            summary_data = self._analyze_summary_data(records_to_analyze)
-            
             # 创建Excel工作簿
             workbook = xlsxwriter.Workbook(file_path)
             worksheet = workbook.add_worksheet("汇总表")
@@ -1619,7 +1835,8 @@ class FinanceCostApp:
             })
             
             # 计算总金额（用于计算占比）
-            total_amount_all = sum(r['loan_amount'] for r in records_to_analyze)
+            total_data = summary_data["全部企业贷款"]
+            total_amount_all = total_data['total_amount']
             
             # 标题
             worksheet.merge_range('A1:I1', '企业贷款融资成本汇总表', title_format)
@@ -1640,38 +1857,16 @@ class FinanceCostApp:
             worksheet.set_row(0, 30)  # 标题行
             worksheet.set_row(2, 35)  # 表头行
             
-            # 定义输出顺序及哪些字段不需要计算（斜线填充）
-            output_config = [
-                ("全部企业贷款", []),
-                ("有利息外费用的企业贷款", []),
-                ("无利息外费用的企业贷款", []),
-                ("大型企业", []),
-                ("中型企业", []),
-                ("小型企业", []),
-                ("微型企业", []),
-                ("个体工商户", []),
-                ("小微企业主", []),
-                ("国有控股", ["avg_amount", "avg_rate", "avg_cost"]),  # 这些列用斜线填充
-                ("非国有控股", ["avg_amount", "avg_rate", "avg_cost"]),
-                ("信用贷款", ["avg_amount", "avg_rate", "avg_cost"]),
-                ("担保贷款", ["avg_amount", "avg_rate", "avg_cost"]),
-                ("抵质押贷款", ["avg_amount", "avg_rate", "avg_cost"]),
-                ("首贷", ["avg_amount", "avg_rate", "avg_cost"]),
-                ("无还本续贷", ["avg_amount", "avg_rate", "avg_cost"]),
-                ("借新换旧", ["avg_amount", "avg_rate", "avg_cost"]),
-                ("线上申请", ["avg_amount", "avg_rate", "avg_cost"]),
-                ("线下申请", ["avg_amount", "avg_rate", "avg_cost"]),
-                ("财政贴息贷款", ["avg_amount", "avg_rate", "avg_cost"])
-            ]
-            
             # 写入数据
             row = 3
             idx = 1
-            for category, skip_fields in output_config:
-                if category in summary_data:
-                    data = summary_data[category]
+            # 按分类规则的顺序输出，规则中指定的列用斜线填充
+            for category in SUMMARY_CATEGORIES:
+                if category.label in summary_data:
+                    data = summary_data[category.label]
+                    skip_fields = category.suppressed
                     worksheet.write(row, 0, idx, cell_format)
-                    worksheet.write(row, 1, category, cell_format)
+                    worksheet.write(row, 1, category.label, cell_format)
                     worksheet.write(row, 2, data['company_count'], cell_format)
                     worksheet.write(row, 3, data['loan_count'], cell_format)
                     worksheet.write(row, 4, data['total_amount'], number_format)
@@ -1701,12 +1896,12 @@ class FinanceCostApp:
                     idx += 1
             
             # 合计行
-            total_companies = len(set(r['company_name'] for r in records_to_analyze))
-            total_loans = len(records_to_analyze)
-            total_amount = sum(r['loan_amount'] for r in records_to_analyze)
+            total_companies = total_data['company_count']
+            total_loans = total_data['loan_count']
+            total_amount = total_data['total_amount']
             avg_amount_total = total_amount / total_loans if total_loans > 0 else 0
-            avg_rate = sum(r['interest_rate'] for r in records_to_analyze) / len(records_to_analyze) if records_to_analyze else 0
-            avg_cost = sum(r['total_cost'] for r in records_to_analyze) / len(records_to_analyze) if records_to_analyze else 0
+            avg_rate = total_data['avg_rate']
+            avg_cost = total_data['avg_cost']
             
             worksheet.write(row, 0, '', cell_format)
             worksheet.write(row, 1, '合计', header_format)
@@ -1723,152 +1918,6 @@ class FinanceCostApp:
             
         except Exception as e:
             messagebox.showerror("错误", f"导出汇总表时发生错误: {str(e)}")
-    
-    def _analyze_summary_data(self, records):
-        """分析汇总数据"""
-        # 初始化汇总分类
-        categories = {
-            "全部企业贷款": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "有利息外费用的企业贷款": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "无利息外费用的企业贷款": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "大型企业": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "中型企业": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "小型企业": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "微型企业": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "个体工商户": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "小微企业主": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "国有控股": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "非国有控股": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "信用贷款": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "担保贷款": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "抵质押贷款": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "首贷": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "无还本续贷": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "借新换旧": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "线上申请": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "线下申请": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []},
-            "财政贴息贷款": {'companies': set(), 'loans': [], 'amount': 0, 'rates': [], 'costs': []}
-        }
-        
-        # 首先，确定哪些企业有利息外费用
-        companies_with_fees = set()
-        for record in records:
-            if record.get('fees'):
-                # 检查是否有非银行承担的费用
-                has_customer_fee = any(fee.get('is_bank_bearing', 0) == 0 for fee in record['fees'])
-                if has_customer_fee:
-                    companies_with_fees.add(record['company_name'])
-        
-        # 分析每条记录
-        for record in records:
-            company_name = record['company_name']
-            loan_amount = record['loan_amount']
-            interest_rate = record['interest_rate']
-            total_cost = record['total_cost']
-            
-            # 全部企业贷款
-            categories["全部企业贷款"]['companies'].add(company_name)
-            categories["全部企业贷款"]['loans'].append(record)
-            categories["全部企业贷款"]['amount'] += loan_amount
-            categories["全部企业贷款"]['rates'].append(interest_rate)
-            categories["全部企业贷款"]['costs'].append(total_cost)
-            
-            # 有/无利息外费用（按企业分类）
-            if company_name in companies_with_fees:
-                categories["有利息外费用的企业贷款"]['companies'].add(company_name)
-                categories["有利息外费用的企业贷款"]['loans'].append(record)
-                categories["有利息外费用的企业贷款"]['amount'] += loan_amount
-                categories["有利息外费用的企业贷款"]['rates'].append(interest_rate)
-                categories["有利息外费用的企业贷款"]['costs'].append(total_cost)
-            else:
-                categories["无利息外费用的企业贷款"]['companies'].add(company_name)
-                categories["无利息外费用的企业贷款"]['loans'].append(record)
-                categories["无利息外费用的企业贷款"]['amount'] += loan_amount
-                categories["无利息外费用的企业贷款"]['rates'].append(interest_rate)
-                categories["无利息外费用的企业贷款"]['costs'].append(total_cost)
-            
-            # 按客户类型分类
-            customer_type = record.get('customer_type', '')
-            if customer_type in categories:
-                categories[customer_type]['companies'].add(company_name)
-                categories[customer_type]['loans'].append(record)
-                categories[customer_type]['amount'] += loan_amount
-                categories[customer_type]['rates'].append(interest_rate)
-                categories[customer_type]['costs'].append(total_cost)
-            
-            # 按企业性质分类
-            company_nature = record.get('company_nature', '')
-            if company_nature in categories:
-                categories[company_nature]['companies'].add(company_name)
-                categories[company_nature]['loans'].append(record)
-                categories[company_nature]['amount'] += loan_amount
-                categories[company_nature]['rates'].append(interest_rate)
-                categories[company_nature]['costs'].append(total_cost)
-            
-            # 按担保方式分类
-            guarantee_type = record.get('guarantee_type', '')
-            if guarantee_type == "信用":
-                cat_name = "信用贷款"
-            elif guarantee_type == "担保":
-                cat_name = "担保贷款"
-            elif guarantee_type == "抵质押":
-                cat_name = "抵质押贷款"
-            else:
-                cat_name = None
-                
-            if cat_name and cat_name in categories:
-                categories[cat_name]['companies'].add(company_name)
-                categories[cat_name]['loans'].append(record)
-                categories[cat_name]['amount'] += loan_amount
-                categories[cat_name]['rates'].append(interest_rate)
-                categories[cat_name]['costs'].append(total_cost)
-            
-            # 按贷款方式分类
-            loan_type = record.get('loan_type', '')
-            if loan_type in categories:
-                categories[loan_type]['companies'].add(company_name)
-                categories[loan_type]['loans'].append(record)
-                categories[loan_type]['amount'] += loan_amount
-                categories[loan_type]['rates'].append(interest_rate)
-                categories[loan_type]['costs'].append(total_cost)
-            
-            # 按申请方式分类
-            application_method = record.get('application_method', '')
-            if application_method == "线上":
-                cat_name = "线上申请"
-            elif application_method == "线下":
-                cat_name = "线下申请"
-            else:
-                cat_name = None
-                
-            if cat_name and cat_name in categories:
-                categories[cat_name]['companies'].add(company_name)
-                categories[cat_name]['loans'].append(record)
-                categories[cat_name]['amount'] += loan_amount
-                categories[cat_name]['rates'].append(interest_rate)
-                categories[cat_name]['costs'].append(total_cost)
-            
-            # 财政贴息贷款
-            if record.get('is_subsidized', 0) == 1:
-                categories["财政贴息贷款"]['companies'].add(company_name)
-                categories["财政贴息贷款"]['loans'].append(record)
-                categories["财政贴息贷款"]['amount'] += loan_amount
-                categories["财政贴息贷款"]['rates'].append(interest_rate)
-                categories["财政贴息贷款"]['costs'].append(total_cost)
-        
-        # 计算汇总数据
-        summary_data = {}
-        for category, data in categories.items():
-            if data['loans']:  # 只包含有数据的分类
-                summary_data[category] = {
-                    'company_count': len(data['companies']),
-                    'loan_count': len(data['loans']),
-                    'total_amount': data['amount'],
-                    'avg_rate': sum(data['rates']) / len(data['rates']) if data['rates'] else 0,
-                    'avg_cost': sum(data['costs']) / len(data['costs']) if data['costs'] else 0
-                }
-        
-        return summary_data
 
 def check_date():
     current_date = datetime.now()
@@ -1886,6 +1935,9 @@ def main():
     root = tk.Tk()
     app = FinanceCostApp(root)
     root.mainloop()
+    app.parallel_calculator.close()
+    app.record_manager.close()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包为exe后进程池需要
     main() 
\ No newline at end of file
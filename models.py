@@ -0,0 +1,178 @@
+import re
+
+# 费用字符串 "费用名:金额元(频率)[银行承担]; ..." 中的一项（兼容全角标点）
+_FEE_ITEM_PATTERN = re.compile(r"""
+    (?P<name>[^:：;；]+?)\s*[:：]\s*
+    (?P<amount>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*元\s*
+    (?:[(（](?P<frequency>[^)）;；]*)[)）])?\s*
+    (?P<bank_bearing>\[银行承担\])?\s*
+    (?:[;；]|\Z)
+""", re.VERBOSE)
+
+# 各项之间的分隔符及空白
+_FEE_SEPARATOR_PATTERN = re.compile(r"[\s;；]*")
+
+
+class Fee:
+    """费用项"""
+    __slots__ = ("name", "amount", "frequency", "is_bank_bearing", "id", "record_id")
+    
+    def __init__(self, name, amount, frequency, is_bank_bearing=0, id=None, record_id=None):
+        self.name = name                        # 费用名称
+        self.amount = amount                    # 费用金额(元)
+        self.frequency = frequency              # 支付频率(年、季、月、期初一次性付费)
+        self.is_bank_bearing = is_bank_bearing  # 是否银行承担(1/0)
+        self.id = id
+        self.record_id = record_id
+    
+    @classmethod
+    def from_row(cls, row):
+        """由finance_fees表的查询结果行构建"""
+        return cls(row["name"], row["amount"], row["frequency"],
+                   row["is_bank_bearing"] or 0, row["id"], row["record_id"])
+    
+    def __repr__(self):
+        return (f"Fee(name={self.name!r}, amount={self.amount!r}, "
+                f"frequency={self.frequency!r}, is_bank_bearing={self.is_bank_bearing!r})")
+
+
+class FinanceRecord:
+    """融资成本记录（对应finance_records表的一行及其费用项）"""
+    # 与finance_records表的列一一对应
+    COLUMNS = (
+        "id", "uuid", "company_name", "loan_amount", "repayment_method", "loan_term",
+        "interest_frequency", "start_date", "end_date", "first_payment_date",
+        "interest_rate", "total_cost", "loan_channel", "customer_type",
+        "company_nature", "guarantee_type", "loan_type", "application_method",
+        "is_subsidized", "create_time"
+    )
+    __slots__ = COLUMNS + ("fees",)
+    
+    def __init__(self, company_name="", loan_amount=0, repayment_method="", loan_term=0,
+                 interest_frequency="", start_date="", end_date="", first_payment_date="",
+                 interest_rate=0, total_cost=0, fees=None, loan_channel="", customer_type="",
+                 company_nature="", guarantee_type="", loan_type="", application_method="",
+                 is_subsidized=0, id=None, uuid=None, create_time=None):
+        self.id = id
+        self.uuid = uuid
+        self.company_name = company_name              # 企业名称
+        self.loan_amount = loan_amount                # 贷款本金(万元)
+        self.repayment_method = repayment_method      # 还款方式
+        self.loan_term = loan_term                    # 贷款期限(月)
+        self.interest_frequency = interest_frequency  # 付息频率
+        self.start_date = start_date                  # 贷款起始日(YYYY-MM-DD)
+        self.end_date = end_date                      # 贷款到期日
+        self.first_payment_date = first_payment_date  # 首次还款日
+        self.interest_rate = interest_rate            # 贷款年化率(%)
+        self.total_cost = total_cost                  # 综合融资成本(%)
+        self.loan_channel = loan_channel
+        self.customer_type = customer_type
+        self.company_nature = company_nature
+        self.guarantee_type = guarantee_type
+        self.loan_type = loan_type
+        self.application_method = application_method
+        self.is_subsidized = is_subsidized
+        self.create_time = create_time
+        self.fees = fees if fees is not None else []  # 费用项列表 [Fee, ...]
+    
+    @classmethod
+    def from_row(cls, row, fees=None):
+        """由finance_records表的查询结果行构建"""
+        record = cls.__new__(cls)
+        for column in cls.COLUMNS:
+            setattr(record, column, row[column])
+        record.fees = fees if fees is not None else []
+        return record
+    
+    def input_key(self):
+        """记录的输入内容（不含ID、UUID、计算结果及创建时间），用于判断导入的记录是否有变化"""
+        return (
+            self.company_name, float(self.loan_amount), self.repayment_method, int(self.loan_term),
+            self.interest_frequency, self.start_date, self.end_date, self.first_payment_date,
+            float(self.interest_rate), self.loan_channel, self.customer_type, self.company_nature,
+            self.guarantee_type, self.loan_type, self.application_method, int(self.is_subsidized or 0),
+            tuple((fee.name, float(fee.amount), fee.frequency, int(fee.is_bank_bearing or 0))
+                  for fee in self.fees)
+        )
+    
+    def __repr__(self):
+        return (f"FinanceRecord(id={self.id!r}, company_name={self.company_name!r}, "
+                f"loan_amount={self.loan_amount!r}, fees={len(self.fees)})")
+
+
+class SummaryCategory:
+    """
+    汇总表分类规则：记录的axis列取值为value时计入名称为label的分类
+    
+    axis为None时包含全部记录；axis为"has_fees"时按企业分类，企业有任一非银行承担的费用时取值为1
+    suppressed: 汇总表中用斜线填充、不计算的列
+    """
+    __slots__ = ("axis", "value", "label", "suppressed")
+    
+    def __init__(self, axis, value, label, suppressed=()):
+        self.axis = axis
+        self.value = value
+        self.label = label
+        self.suppressed = suppressed
+    
+    def __repr__(self):
+        return f"SummaryCategory(axis={self.axis!r}, value={self.value!r}, label={self.label!r})"
+
+
+# 汇总表不计算平均值的分类
+_NO_AVERAGES = ("avg_amount", "avg_rate", "avg_cost")
+
+# 汇总表的分类及输出顺序，新增分类只需在此添加规则
+SUMMARY_CATEGORIES = (
+    SummaryCategory(None, None, "全部企业贷款"),
+    SummaryCategory("has_fees", 1, "有利息外费用的企业贷款"),
+    SummaryCategory("has_fees", 0, "无利息外费用的企业贷款"),
+    SummaryCategory("customer_type", "大型企业", "大型企业"),
+    SummaryCategory("customer_type", "中型企业", "中型企业"),
+    SummaryCategory("customer_type", "小型企业", "小型企业"),
+    SummaryCategory("customer_type", "微型企业", "微型企业"),
+    SummaryCategory("customer_type", "个体工商户", "个体工商户"),
+    SummaryCategory("customer_type", "小微企业主", "小微企业主"),
+    SummaryCategory("company_nature", "国有控股", "国有控股", _NO_AVERAGES),
+    SummaryCategory("company_nature", "非国有控股", "非国有控股", _NO_AVERAGES),
+    SummaryCategory("guarantee_type", "信用", "信用贷款", _NO_AVERAGES),
+    SummaryCategory("guarantee_type", "担保", "担保贷款", _NO_AVERAGES),
+    SummaryCategory("guarantee_type", "抵质押", "抵质押贷款", _NO_AVERAGES),
+    SummaryCategory("loan_type", "首贷", "首贷", _NO_AVERAGES),
+    SummaryCategory("loan_type", "无还本续贷", "无还本续贷", _NO_AVERAGES),
+    SummaryCategory("loan_type", "借新换旧", "借新换旧", _NO_AVERAGES),
+    SummaryCategory("application_method", "线上", "线上申请", _NO_AVERAGES),
+    SummaryCategory("application_method", "线下", "线下申请", _NO_AVERAGES),
+    SummaryCategory("is_subsidized", 1, "财政贴息贷款", _NO_AVERAGES),
+)
+
+
+def parse_fees(text):
+    """
+    解析费用字符串 "费用名:金额元(频率)[银行承担]; ..."，返回Fee列表
+    
+    未写频率的费用按期初一次性付费处理；无法解析的内容抛出ValueError
+    """
+    fees = []
+    position = _FEE_SEPARATOR_PATTERN.match(text).end()
+    while position < len(text):
+        match = _FEE_ITEM_PATTERN.match(text, position)
+        if match is None:
+            item = re.split(r"[;；]", text[position:], maxsplit=1)[0].strip()
+            raise ValueError(f"无法解析的费用项: {item}")
+        fees.append(Fee(
+            match.group("name").strip(),
+            float(match.group("amount")),
+            match.group("frequency") or "期初一次性付费",
+            1 if match.group("bank_bearing") else 0
+        ))
+        position = _FEE_SEPARATOR_PATTERN.match(text, match.end()).end()
+    return fees
+
+
+def format_fees(fees):
+    """将费用列表格式化为 "费用名:金额元(频率)[银行承担]; ..." """
+    return "; ".join(
+        f"{fee.name}:{fee.amount}元({fee.frequency})" + ("[银行承担]" if fee.is_bank_bearing == 1 else "")
+        for fee in fees
+    )